@@ -0,0 +1,181 @@
+#!/usr/bin/env python3.7
+import argparse
+import json
+import os
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Fake client replaces sonm_pynode, results don't include its request building and signing costs
+SCOPE_NOTE = "Measured with bench FakeNodeClient and fake market routes instead of sonm_pynode.Node and Sonm node " \
+             "REST api: control loop, SonmApi and pooled session are covered, sonm_pynode client, its routes and " \
+             "PooledTransport module patching are not. These aren't end-to-end numbers"
+
+BASE_CONFIG = {
+    "http_server": {"run": False},
+    "node_address": "",
+    "ethereum": {"key_path": "", "password": ""},
+    "journal": False,
+    "reconcile_interval": 5,
+    "tasks": ["bench_config.yaml"],
+}
+
+TASK_CONFIG = {
+    "numberofnodes": 10, "tag": "BENCH", "price_coefficient": 10, "max_price": "0.02", "ets": 180,
+    "task_start_timeout": 600, "template_file": "bench_task.yaml", "duration": "0h", "counterparty": "",
+    "identity": "anonymous", "ramsize": 2000, "storagesize": 1, "cpucores": 1, "sysbenchsingle": 500,
+    "sysbenchmulti": 1000, "netdownload": 10, "netupload": 10, "overlay": False, "incoming": False, "gpucount": 0,
+    "gpumem": 0, "ethhashrate": 0, "cashhashrate": 0,
+}
+
+TASK_TEMPLATE = """container:
+  image: "sonm/bench:latest"
+  env:
+    WORKER: "{{ node_tag }}"
+"""
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def write_configs(folder, nodes):
+    conf = os.path.join(folder, "conf")
+    os.makedirs(conf)
+    task_config = dict(TASK_CONFIG, numberofnodes=nodes)
+    for filename, data in [("config.yaml", BASE_CONFIG), ("bench_config.yaml", task_config)]:
+        with open(os.path.join(conf, filename), "w") as f:
+            json.dump(data, f)
+    with open(os.path.join(conf, "bench_task.yaml"), "w") as f:
+        f.write(TASK_TEMPLATE)
+
+
+def server_stats(endpoint):
+    return requests.post(endpoint + "/stats", json={}).json()
+
+
+def run_child(args):
+    # Runs taskman in this process against the fake node and prints measurements as the last line
+    sys.path.insert(0, ROOT)
+    os.chdir(args.workdir)
+    nodes_num = args.nodes[0]
+    import logging
+    import taskman
+    from bench.fake_node import FakeNodeClient
+    from source.sonmapi import SonmApi
+    from source.utils import Nodes
+    from source.worknode import State
+    logging.getLogger("monitor").setLevel(logging.WARNING)
+
+    sonm_api = SonmApi("", "", args.endpoint, 60, node=FakeNodeClient(args.endpoint))
+    started = time.time()
+    threading.Thread(target=taskman.main, args=(sonm_api,), daemon=True).start()
+    filled_at = None
+    calls_at_fill = 0
+    max_lag = 0.0
+    while time.time() - started < args.timeout:
+        time.sleep(1)
+        nodes = Nodes.get_nodes_arr()
+        now = time.time()
+        lags = [now - node.last_heartbeat for node in nodes if node.status != State.WORK_COMPLETED]
+        max_lag = max([max_lag] + lags)
+        running = len([node for node in nodes if node.status == State.TASK_RUNNING])
+        if filled_at is None and running >= nodes_num:
+            filled_at = now
+            calls_at_fill = sum(server_stats(args.endpoint)["calls"].values())
+        if filled_at and now - filled_at >= args.steady:
+            break
+    finished = time.time()
+    calls = sum(server_stats(args.endpoint)["calls"].values())
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    transport = sonm_api.transport.metrics()
+    steady_minutes = (finished - filled_at) / 60 if filled_at else 0
+    result = {
+        "nodes": nodes_num,
+        "filled": len([node for node in Nodes.get_nodes_arr() if node.status == State.TASK_RUNNING]),
+        "time_to_fill": round(filled_at - started, 1) if filled_at else None,
+        "calls_per_node_minute": round(calls / nodes_num / ((finished - started) / 60), 2),
+        "steady_calls_per_node_minute":
+            round((calls - calls_at_fill) / nodes_num / steady_minutes, 2) if steady_minutes else None,
+        "cpu_sec": round(usage.ru_utime + usage.ru_stime, 1),
+        "rss_mb": round(usage.ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1),
+        "max_heartbeat_lag": round(max_lag, 1),
+        "connections": transport["connections"],
+        "client": "fake",
+    }
+    print("RESULT " + json.dumps(result), flush=True)
+    os._exit(0)
+
+
+def run_size(args, nodes):
+    port = free_port()
+    endpoint = "http://127.0.0.1:{}".format(port)
+    server = subprocess.Popen([sys.executable, "-m", "bench.fake_node", "--port", str(port),
+                               "--latency", str(args.latency), "--jitter", str(args.jitter),
+                               "--error-rate", str(args.error_rate), "--match-delay", str(args.match_delay),
+                               "--match-rate", str(args.match_rate)],
+                              cwd=ROOT, stdout=subprocess.DEVNULL)
+    try:
+        for _ in range(50):
+            try:
+                server_stats(endpoint)
+                break
+            except requests.ConnectionError:
+                time.sleep(0.1)
+        with tempfile.TemporaryDirectory() as workdir:
+            write_configs(workdir, nodes)
+            child = subprocess.run([sys.executable, "-m", "bench.benchmark", "--child", "--nodes", str(nodes),
+                                    "--endpoint", endpoint, "--workdir", workdir, "--timeout", str(args.timeout),
+                                    "--steady", str(args.steady)],
+                                   cwd=ROOT, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                   universal_newlines=True)
+        lines = [line for line in child.stdout.splitlines() if line.startswith("RESULT ")]
+        return json.loads(lines[-1][len("RESULT "):]) if lines else {"nodes": nodes, "error": "no result"}
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Control loop throughput benchmark against a fake Sonm node. " +
+                                                 SCOPE_NOTE)
+    parser.add_argument("--nodes", type=int, nargs="+", default=[10, 100, 1000, 5000])
+    parser.add_argument("--timeout", type=float, default=900, help="max run time for one fleet size, sec")
+    parser.add_argument("--steady", type=float, default=120, help="time to keep measuring after fill, sec")
+    parser.add_argument("--latency", type=float, default=0.01)
+    parser.add_argument("--jitter", type=float, default=0.01)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--match-delay", type=float, default=5.0)
+    parser.add_argument("--match-rate", type=float, default=1.0)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--endpoint", help=argparse.SUPPRESS)
+    parser.add_argument("--workdir", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        run_child(args)
+        return
+    print(SCOPE_NOTE, flush=True)
+    results = []
+    for nodes in args.nodes:
+        result = run_size(args, nodes)
+        print(json.dumps(result), flush=True)
+        results.append(result)
+    from tabulate import tabulate
+    columns = ["nodes", "filled", "time_to_fill", "calls_per_node_minute", "steady_calls_per_node_minute", "cpu_sec",
+               "rss_mb", "max_heartbeat_lag", "connections", "client"]
+    print(tabulate([[result.get(column) for column in columns] for result in results], columns, tablefmt="grid"))
+    print(SCOPE_NOTE)
+
+
+if __name__ == "__main__":
+    main()
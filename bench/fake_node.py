@@ -0,0 +1,240 @@
+#!/usr/bin/env python3.7
+import argparse
+import base64
+import heapq
+import itertools
+import json
+import random
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import requests
+
+ETH_ADDR = "0x" + "0" * 39 + "1"
+METHODS = {"order_create", "order_status", "order_list", "order_cancel", "deal_list", "deal_status", "deal_close",
+           "task_start", "task_status", "predict", "token_balance"}
+
+
+class FakeMarket(object):
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, match_delay=5.0, match_rate=1.0, spool_time=0.0,
+                 task_fail_rate=0.0, price_per_second="2777777777777"):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.match_delay = match_delay
+        self.match_rate = match_rate
+        self.spool_time = spool_time
+        self.task_fail_rate = task_fail_rate
+        self.price_per_second = price_per_second
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+        self.orders = {}
+        self.pending = []
+        self.deals = {}
+        self.tasks = {}
+        self.calls = {}
+
+    def advance(self):
+        # Orders are matched with deals after match_delay, some of them never are (match_rate)
+        now = time.time()
+        while self.pending and self.pending[0][0] <= now:
+            order_ = self.orders[heapq.heappop(self.pending)[1]]
+            if order_["status"] == 2 and order_["match_at"]:
+                deal_id = str(next(self.ids))
+                self.deals[deal_id] = {"id": deal_id, "bidID": order_["id"], "status": 1, "price": order_["price"],
+                                       "tasks": {}}
+                order_.update({"status": 1, "dealID": deal_id})
+
+    def order_create(self, body):
+        order_id = str(next(self.ids))
+        match_at = time.time() + self.match_delay if random.random() < self.match_rate else None
+        self.orders[order_id] = {"id": order_id, "tag": body.get("tag", ""), "price": body["price"]["perSecond"],
+                                 "status": 2, "dealID": "0", "match_at": match_at}
+        if match_at:
+            heapq.heappush(self.pending, (match_at, order_id))
+        return {"id": order_id}
+
+    def order_status(self, body):
+        order_ = self.orders.get(body["id"])
+        if not order_:
+            return None
+        return {"orderStatus": order_["status"], "tag": encode_tag(order_["tag"]), "dealID": order_["dealID"]}
+
+    def order_list(self, body):
+        active_ = [order_ for order_ in self.orders.values() if order_["status"] == 2][:int(body["limit"])]
+        return {"orders": [{"order": {"id": order_["id"], "tag": encode_tag(order_["tag"]), "price": order_["price"]}}
+                           for order_ in active_]}
+
+    def order_cancel(self, body):
+        for order_id in body["ids"]:
+            if order_id in self.orders and self.orders[order_id]["status"] == 2:
+                self.orders[order_id].update({"status": 1, "match_at": None})
+        return {}
+
+    def deal_list(self, body):
+        open_ = [deal_ for deal_ in self.deals.values() if deal_["status"] == 1][:int(body["limit"])]
+        return {"deals": [{"deal": {"id": deal_["id"], "bidID": deal_["bidID"], "status": deal_["status"],
+                                    "price": deal_["price"]}} for deal_ in open_]}
+
+    def deal_status(self, body):
+        deal_ = self.deals.get(body["id"])
+        if not deal_:
+            return None
+        result = {"deal": {"id": deal_["id"], "bidID": deal_["bidID"], "status": deal_["status"],
+                           "price": deal_["price"]}}
+        if deal_["status"] == 1:
+            result["resources"] = {}
+            if deal_["tasks"]:
+                result["running"] = {task_id: {} for task_id in deal_["tasks"]}
+        return result
+
+    def deal_close(self, body):
+        deal_ = self.deals.get(body["id"])
+        if not deal_:
+            return None
+        deal_["status"] = 2
+        return {}
+
+    def task_start(self, body):
+        deal_ = self.deals.get(body["deal_id"])
+        if not deal_ or deal_["status"] != 1:
+            return None
+        task_id = str(next(self.ids))
+        self.tasks[task_id] = {"started": time.time(), "broken": random.random() < self.task_fail_rate}
+        deal_["tasks"][task_id] = True
+        return {"id": task_id}
+
+    def task_status(self, body):
+        task_ = self.tasks.get(body["task_id"])
+        if not task_:
+            return None
+        uptime = time.time() - task_["started"]
+        status = 1 if uptime < self.spool_time else (5 if task_["broken"] else 3)
+        return {"status": status, "uptime": str(int(uptime * 1e9))}
+
+    def predict(self, body):
+        return {"perSecond": self.price_per_second}
+
+    def token_balance(self, body):
+        return {"liveBalance": 1000.0, "sideBalance": 1000.0, "liveEthBalance": 1.0}
+
+    def handle(self, method, body):
+        delay = self.latency + random.uniform(0, self.jitter)
+        if delay:
+            time.sleep(delay)
+        with self.lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+            if random.random() < self.error_rate:
+                return 500, {"error": "fake failure"}
+            self.advance()
+            result = getattr(self, method)(body)
+        return (200, result) if result is not None else (404, {"error": "not found"})
+
+    def stats(self):
+        with self.lock:
+            return {"calls": dict(self.calls),
+                    "orders": len([o for o in self.orders.values() if o["status"] == 2]),
+                    "deals": len([d for d in self.deals.values() if d["status"] == 1])}
+
+
+def encode_tag(tag):
+    return base64.b64encode(tag.encode()).decode()
+
+
+def create_server(market, host="127.0.0.1", port=15031):
+    # Routes are named after SonmApi methods, they aren't Node REST API routes: only FakeNodeClient talks to it
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            if self.path == "/stats":
+                self.reply(200, market.stats())
+            elif self.path.strip("/") in METHODS:
+                self.reply(*market.handle(self.path.strip("/"), body))
+            else:
+                self.reply(404, {"error": "unknown method"})
+
+        def reply(self, code, data):
+            payload = json.dumps(data).encode()
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    return server
+
+
+class FakeNodeClient(object):
+    # Same surface as sonm_pynode.main.Node, as used by SonmApi. Request signing and encoding of sonm_pynode
+    # aren't measured with it. PooledTransport swaps its session, but not the module patching used for sonm_pynode
+    def __init__(self, endpoint):
+        self.endpoint = endpoint.rstrip("/")
+        self.eth_addr = ETH_ADDR
+        self.session = requests.Session()
+        self.order = Group(self, {"create": ("order_create", None), "status": ("order_status", ["id"]),
+                                  "list": ("order_list", ["addr", "limit"]), "cancel": ("order_cancel", ["ids"])})
+        self.deal = Group(self, {"list": ("deal_list", None), "status": ("deal_status", ["id"]),
+                                 "close": ("deal_close", ["id", "blacklist"])})
+        self.task = Group(self, {"start": ("task_start", ["deal_id", "task"]),
+                                 "status": ("task_status", ["deal_id", "task_id"])})
+        self.predictor = Group(self, {"predict": ("predict", ["bid"])})
+        self.token = Group(self, {"balance": ("token_balance", [])})
+
+    def call(self, method, body, timeout=60):
+        try:
+            r = self.session.post("{}/{}".format(self.endpoint, method), json=body, timeout=timeout)
+            result = r.json()
+            result["status_code"] = r.status_code
+        except requests.RequestException as e:
+            result = {"status_code": 0, "error": str(e)}
+        return result
+
+
+class Group(object):
+    def __init__(self, client, methods):
+        self.client = client
+        self.methods = methods
+
+    def __getattr__(self, name):
+        method, params = self.methods[name]
+
+        def call(*args, timeout=60):
+            # params None means that the only argument is sent as request body
+            body = args[0] if params is None else dict(zip(params, args))
+            return self.client.call(method, body, timeout)
+
+        return call
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake Sonm market for bench FakeNodeClient, "
+                                                 "it doesn't serve Sonm node REST api routes")
+    parser.add_argument("--port", type=int, default=15031)
+    parser.add_argument("--latency", type=float, default=0.0, help="base response latency, sec")
+    parser.add_argument("--jitter", type=float, default=0.0, help="random extra latency, sec")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests failing with 500")
+    parser.add_argument("--match-delay", type=float, default=5.0, help="time before order gets a deal, sec")
+    parser.add_argument("--match-rate", type=float, default=1.0, help="share of orders which get a deal")
+    parser.add_argument("--spool-time", type=float, default=0.0, help="time task stays in spooling state, sec")
+    parser.add_argument("--task-fail-rate", type=float, default=0.0, help="share of tasks which become broken")
+    args = parser.parse_args()
+    market = FakeMarket(args.latency, args.jitter, args.error_rate, args.match_delay, args.match_rate,
+                        args.spool_time, args.task_fail_rate)
+    server = create_server(market, port=args.port)
+    print("Fake sonm node listening on http://127.0.0.1:{}".format(server.server_address[1]), flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger("monitor")
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, retry_in):
+        super().__init__("Node API is unavailable, next check in {:.0f} sec".format(retry_in))
+        self.retry_in = retry_in
+
+
+class CircuitBreaker(object):
+    # Shared by all requests of one SonmApi. Opens after `threshold` failed requests in a row, requests are rejected
+    # without calling node api while it's open. After `reset_timeout` one probe request is let through,
+    # its result closes the breaker or opens it again. threshold 0 disables the breaker
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, threshold=5, reset_timeout=30):
+        self.threshold = int(threshold)
+        self.reset_timeout = float(reset_timeout)
+        self.state = CircuitBreaker.CLOSED
+        self.failures = 0
+        self.opened = 0
+        self.lock = threading.Lock()
+
+    def is_open(self):
+        return self.state != CircuitBreaker.CLOSED
+
+    def retry_in(self):
+        if self.state == CircuitBreaker.OPEN:
+            return max(self.opened + self.reset_timeout - time.time(), 1)
+        return self.reset_timeout
+
+    def before_call(self):
+        if self.state == CircuitBreaker.CLOSED:
+            return
+        with self.lock:
+            if self.state == CircuitBreaker.OPEN and time.time() - self.opened >= self.reset_timeout:
+                self.state = CircuitBreaker.HALF_OPEN
+                logger.info("Checking Node API availability with probe request")
+                return
+            if self.state != CircuitBreaker.CLOSED:
+                raise CircuitOpenError(self.retry_in())
+
+    def record(self, healthy):
+        if self.threshold <= 0 or (healthy and self.state == CircuitBreaker.CLOSED and self.failures == 0):
+            return
+        with self.lock:
+            if healthy:
+                if self.state != CircuitBreaker.CLOSED:
+                    logger.info("Node API is available again, resuming nodes")
+                self.state = CircuitBreaker.CLOSED
+                self.failures = 0
+                return
+            self.failures += 1
+            if self.state == CircuitBreaker.HALF_OPEN or \
+                    (self.state == CircuitBreaker.CLOSED and self.failures >= self.threshold):
+                logger.error("Node API failed {} requests in a row, nodes are paused for {:.0f} sec"
+                             .format(self.failures, self.reset_timeout))
+                self.state = CircuitBreaker.OPEN
+                self.opened = time.time()
@@ -1,50 +1,65 @@
+import hashlib
 import json
 import os
+from collections import namedtuple
 from os.path import join
 
 from pathlib2 import Path
 from ruamel.yaml import YAML
 
-from source.utils import logger, validate_eth_addr, template_bid
+from source.prices import PriceCache
+from source.utils import logger, validate_eth_addr, template_bid, shard_of
+
+ConfigDiff = namedtuple("ConfigDiff", ["added", "removed", "changed", "changed_bids"])
 
 
 class Config(object):
     base_config = {}
     node_configs = {}
     config_folder = "conf/"
+    # (index, count) of this process in sharded mode, nodes of other shards are skipped
+    shard = None
+    fleet_size = 0
 
     bids = {}
-    prices = {}
+    price_keys = {}
     balance = {}
+    files = {}
 
     @staticmethod
     def price_for_tag(tag):
-        if tag in Config.prices.keys():
-            return Config.prices[tag]
+        if tag in Config.price_keys.keys():
+            return PriceCache.get(Config.price_keys[tag])
         else:
             return None
 
     @staticmethod
     def formatted_price_for_tag(tag):
-        if tag in Config.prices.keys() and Config.prices[tag] and "perHourUSD" in Config.prices[tag]:
-            return "{:.4f} USD/h".format(Config.prices[tag]["perHourUSD"])
+        price_ = Config.price_for_tag(tag)
+        if price_ and "perHourUSD" in price_:
+            return "{:.4f} USD/h".format(price_["perHourUSD"])
         else:
             return ""
 
     @staticmethod
     def load_bid_configs(bids_):
-        if len(Config.bids) == 0:
-            Config.bids = bids_
-        else:
-            for tag in bids_.keys():
-                if tag in Config.bids and Config.bids[tag] == bids_[tag]:
-                    continue
-                Config.bids[tag] = bids_[tag]
+        changed_ = set()
+        for tag in bids_.keys():
+            if tag in Config.bids and Config.bids[tag] == bids_[tag]:
+                continue
+            Config.bids[tag] = bids_[tag]
+            changed_.add(tag)
+        for tag in [tag for tag in Config.bids.keys() if tag not in bids_]:
+            del Config.bids[tag]
+        Config.price_keys = {tag: PriceCache.add(bid["resources"]) for tag, bid in Config.bids.items()}
+        PriceCache.retain(set(Config.price_keys.values()))
+        return changed_
 
     @staticmethod
-    def load_prices(sonm_api):
-        for tag, bid in Config.bids.items():
-            Config.prices[tag] = sonm_api.predict_bid(bid["resources"])
+    def load_prices(sonm_api, tags=None):
+        PriceCache.ttl = int(Config.base_config["price_ttl"]) if "price_ttl" in Config.base_config else 600
+        return PriceCache.refresh(sonm_api,
+                                  {key for tag, key in Config.price_keys.items() if tags is None or tag in tags})
 
     @staticmethod
     def get_node_config(node_tag):
@@ -53,7 +68,7 @@ class Config(object):
     @staticmethod
     def load_config():
         Config.load_base_config()
-        Config.load_task_configs()
+        return Config.load_task_configs()
 
     @staticmethod
     def load_task_configs():
@@ -85,8 +100,18 @@ class Config(object):
                 temp_node_configs[ntag] = task_config
                 logger.debug("Config for node {} was created successfully".format(ntag))
                 logger.debug("Config: {}".format(json.dumps(task_config, sort_keys=True, indent=4)))
+        Config.fleet_size = len(temp_node_configs)
+        if Config.shard:
+            temp_node_configs = {ntag: config_ for ntag, config_ in temp_node_configs.items()
+                                 if shard_of(ntag, Config.shard[1]) == Config.shard[0]}
+        previous_ = Config.node_configs
         Config.node_configs = temp_node_configs
-        Config.load_bid_configs(temp_bids)
+        changed_bids = Config.load_bid_configs(temp_bids)
+        return ConfigDiff(added={ntag for ntag in temp_node_configs if ntag not in previous_},
+                          removed={ntag for ntag in previous_ if ntag not in temp_node_configs},
+                          changed={ntag for ntag, config_ in temp_node_configs.items()
+                                   if ntag in previous_ and previous_[ntag] is not config_},
+                          changed_bids=changed_bids)
 
     @staticmethod
     def load_base_config():
@@ -102,20 +127,24 @@ class Config(object):
         if len(missed_keys) > 0:
             raise Exception("Missed keys: '{}'".format("', '".join(missed_keys)))
 
-    @staticmethod
-    def reload_node_config(node_tag):
-        Config.base_config = Config.load_cfg()
-        for task in Config.base_config["tasks"]:
-            task_config = Config.load_cfg(task)
-            if node_tag.startswith(task_config["tag"] + "_"):
-                Config.node_configs[node_tag] = task_config
-
     @staticmethod
     def load_cfg(filename='config.yaml', folder=config_folder):
+        # Parsed files are cached, file is parsed again only if its mtime and content were changed
         path = join(folder, filename)
         if os.path.exists(path):
-            p = Path(path)
+            mtime_ = os.stat(path).st_mtime
+            cached_ = Config.files.get(path)
+            if cached_ and cached_["mtime"] == mtime_:
+                return cached_["data"]
+            content_ = Path(path).read_bytes()
+            hash_ = hashlib.sha1(content_).hexdigest()
+            if cached_ and cached_["hash"] == hash_:
+                cached_["mtime"] = mtime_
+                return cached_["data"]
+            logger.debug("Parsing {}".format(path))
             yaml_ = YAML(typ='safe')
-            return yaml_.load(p)
+            data_ = yaml_.load(content_.decode("utf-8"))
+            Config.files[path] = {"mtime": mtime_, "hash": hash_, "data": data_}
+            return data_
         else:
             raise Exception("File {} not found".format(filename))
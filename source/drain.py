@@ -0,0 +1,61 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from source.config import Config
+from source.reconciler import Reconciler
+from source.worknode import State
+
+logger = logging.getLogger("monitor")
+
+DEAL_STATES = [State.DEAL_OPENED, State.DEAL_DISAPPEARED, State.STARTING_TASK, State.TASK_RUNNING, State.TASK_FAILED,
+               State.TASK_FAILED_TO_START, State.TASK_BROKEN, State.TASK_FINISHED]
+
+
+def drain_config():
+    return Config.base_config["drain"] if "drain" in Config.base_config else {}
+
+
+def drain_nodes(sonm_api, nodes_, futures=()):
+    # Stops nodes, cancels their orders in batches and closes their deals in parallel under one deadline
+    config_ = drain_config()
+    deadline = float(config_.get("deadline", 300))
+    started = time.time()
+    for node in nodes_:
+        node.stop_work()
+    if futures:
+        # Node loops exit after their current api call, node states don't change after that
+        wait(futures, timeout=deadline)
+    cancelled = cancel_orders(sonm_api, nodes_, int(config_.get("batch", 100)))
+    deals_ = [node for node in nodes_ if node.deal_id and node.status in DEAL_STATES]
+    executor = ThreadPoolExecutor(max_workers=int(config_.get("workers", 20)), thread_name_prefix="drain")
+    closes_ = [executor.submit(node.drain_deal, config_.get("save_logs", False)) for node in deals_]
+    done, not_done = wait(closes_, timeout=max(deadline - (time.time() - started), 0))
+    executor.shutdown(wait=False)
+    for node in nodes_:
+        if node.status in [State.START, State.CREATE_ORDER]:
+            node.status = State.WORK_COMPLETED
+    closed = len([future for future in done if not future.exception() and future.result()])
+    logger.info("Drained {} nodes in {:.1f} sec: {} orders cancelled, {} of {} deals closed"
+                .format(len(nodes_), time.time() - started, cancelled, closed, len(deals_)))
+    if not_done:
+        logger.error("{} deals weren't closed before drain deadline ({} sec)".format(len(not_done), deadline))
+
+
+def cancel_orders(sonm_api, nodes_, batch):
+    by_order = {node.bid_id: node for node in nodes_ if node.status == State.AWAITING_DEAL and node.bid_id}
+    # Orders which are on market, but unknown to nodes (e.g. placed right before restart), are cancelled too
+    node_tags = {node.node_tag for node in nodes_}
+    orphans_ = [order_["id"] for node_tag, order_ in Reconciler.orders_by_tag.items()
+                if node_tag in node_tags and order_["id"] not in by_order]
+    order_ids = list(by_order.keys()) + orphans_
+    if not order_ids:
+        return 0
+    failed_ = set(sonm_api.order_cancel_many(order_ids, batch))
+    for order_id, node in by_order.items():
+        if order_id in failed_:
+            logger.error("Cannot cancel order {} (Node {})".format(order_id, node.node_tag))
+            continue
+        node.bid_id = ""
+        node.status = State.WORK_COMPLETED
+    return len(order_ids) - len(failed_)
@@ -0,0 +1,43 @@
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from source.sonmapi import AsyncSonmApi
+
+logger = logging.getLogger("monitor")
+
+
+class NodeEngine:
+    def __init__(self, sonm_api, max_workers=20, log_workers=4):
+        self.sonm_api = sonm_api
+        self.loop = asyncio.new_event_loop()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="sonm-api")
+        # Task log downloads take minutes, they have their own threads so api requests don't queue behind them
+        self.logs_executor = ThreadPoolExecutor(max_workers=log_workers, thread_name_prefix="task-logs")
+        self.api = AsyncSonmApi(sonm_api, self.executor, self.logs_executor)
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run_loop, name="node-engine", daemon=True)
+        self.thread.start()
+        logger.info("Node engine started, {} workers for node api requests".format(self.executor._max_workers))
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def submit(self, node, delay=0):
+        return asyncio.run_coroutine_threadsafe(self.watch(node, delay), self.loop)
+
+    async def watch(self, node, delay):
+        if delay:
+            await asyncio.sleep(delay)
+        await node.watch_node(self)
+
+    def stop(self):
+        if self.loop.is_running():
+            self.loop.call_soon_threadsafe(self.loop.stop)
+        self.executor.shutdown(wait=False)
+        self.logs_executor.shutdown(wait=False)
+        logger.info("Node engine stopped")
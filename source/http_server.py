@@ -1,21 +1,32 @@
+import collections
+import hashlib
+import hmac
+import json
 import logging
+import secrets
 import threading
 import time
-from collections import defaultdict
 from functools import wraps
+from urllib.parse import urlparse
 
 from flask_table import Table, Col
-from flask import Flask, render_template, request, Response
+from flask import Flask, render_template, request, Response, make_response, redirect
 from flask_bootstrap import Bootstrap
 
+from source.metrics import Metrics
 from source.utils import Nodes
 from source.config import Config
+from source.worknode import State
 
 logger = logging.getLogger("monitor")
 
 
 class SonmHttpServer:
     KEEP_RUNNING = True
+    # Set by main process: drain(tag) stops nodes of the tag, cancels their orders and closes deals
+    drain = None
+    # Embedded in dashboard forms, other sites can't read it from the page
+    csrf_token = secrets.token_urlsafe(32)
 
 
 def check_auth(username, password):
@@ -41,12 +52,134 @@ def requires_auth(f):
     return decorated
 
 
+def same_origin():
+    # Browsers send Origin (or at least Referer) with form posts, a post from another site is rejected
+    source_ = request.headers.get("Origin") or request.headers.get("Referer")
+    return not source_ or urlparse(source_).netloc == request.host
+
+
+def valid_csrf_token():
+    return hmac.compare_digest(request.form.get("csrf_token", ""), SonmHttpServer.csrf_token)
+
+
+def refresh_interval():
+    http_config = Config.base_config["http_server"] if "http_server" in Config.base_config else {}
+    return int(http_config["refresh_interval"]) if "refresh_interval" in http_config else 5
+
+
+def rebuild_interval():
+    http_config = Config.base_config["http_server"] if "http_server" in Config.base_config else {}
+    return float(http_config["rebuild_interval"]) if "rebuild_interval" in http_config else 1
+
+
+def event_interval():
+    http_config = Config.base_config["http_server"] if "http_server" in Config.base_config else {}
+    return float(http_config["event_interval"]) if "event_interval" in http_config else 0.5
+
+
+class Dashboard(object):
+    # Rendered page is rebuilt only when nodes changed or refresh interval passed,
+    # but not more often than rebuild interval: with many nodes some node changes every moment
+    lock = threading.Lock()
+    page = None
+    etag = None
+    version = None
+    built = 0
+
+    @staticmethod
+    def snapshot():
+        with Dashboard.lock:
+            since_ = time.time() - Dashboard.built
+            if (Dashboard.version != Nodes.version and since_ >= rebuild_interval()) or \
+                    since_ >= refresh_interval():
+                Dashboard.version = Nodes.version
+                Dashboard.page = Dashboard.render()
+                Dashboard.etag = hashlib.sha1(Dashboard.page.encode()).hexdigest()
+                Dashboard.built = time.time()
+            return Dashboard.page, Dashboard.etag
+
+    @staticmethod
+    def render():
+        nodes_content = [{
+            'node_tag': tag,
+            'predicted_price': Config.formatted_price_for_tag(tag),
+            'nodes_table': NodesTable([node.as_table_item for node in Nodes.get_tag_nodes(tag)],
+                                      classes=['table', 'table-striped', 'table-bordered'])
+        }
+            for tag in Nodes.get_tags()]
+        return render_template('index.html', nodes=nodes_content, token_balance=Config.balance,
+                               csrf_token=SonmHttpServer.csrf_token)
+
+
+class LiveRows(object):
+    # Rows of all nodes are compared once per event interval for all open pages,
+    # each page receives rows changed since its previous event
+    COLUMNS = ["order_id", "order_price", "deal_id", "task_id", "task_uptime", "node_status", "css_class"]
+    lock = threading.Lock()
+    rows = {}
+    changes = collections.deque(maxlen=100)
+    seq = 0
+    updated = 0
+
+    @staticmethod
+    def row(node):
+        item_ = node.as_table_item
+        row_ = {column: getattr(item_, column) for column in LiveRows.COLUMNS}
+        # Pages count seconds since heartbeat on their own
+        row_["heartbeat"] = node.last_heartbeat if node.status != State.WORK_COMPLETED else None
+        return row_
+
+    @staticmethod
+    def update():
+        with LiveRows.lock:
+            if time.time() - LiveRows.updated < event_interval():
+                return
+            rows_ = {node.node_tag: LiveRows.row(node) for node in Nodes.get_nodes_arr()}
+            changed_ = {node_tag: row_ for node_tag, row_ in rows_.items() if LiveRows.rows.get(node_tag) != row_}
+            removed_ = [node_tag for node_tag in LiveRows.rows if node_tag not in rows_]
+            if changed_ or removed_:
+                LiveRows.seq += 1
+                LiveRows.changes.append((LiveRows.seq, changed_, removed_))
+            LiveRows.rows = rows_
+            LiveRows.updated = time.time()
+
+    @staticmethod
+    def since(seq):
+        # Pages which are new or missed too many changes get all rows
+        with LiveRows.lock:
+            if seq is None or not LiveRows.changes or LiveRows.changes[0][0] > seq + 1:
+                return LiveRows.seq, dict(LiveRows.rows), []
+            changed_ = {}
+            removed_ = []
+            for seq_, rows_, removed in LiveRows.changes:
+                if seq_ > seq:
+                    changed_.update(rows_)
+                    removed_ += removed
+            return LiveRows.seq, changed_, removed_
+
+    @staticmethod
+    def stream():
+        seq = None
+        sent = time.time()
+        while SonmHttpServer.KEEP_RUNNING:
+            LiveRows.update()
+            seq, changed_, removed_ = LiveRows.since(seq)
+            if changed_ or removed_:
+                yield "data: {}\n\n".format(json.dumps({"now": time.time(), "rows": changed_, "removed": removed_}))
+                sent = time.time()
+            elif time.time() - sent >= 15:
+                # Disconnected pages are found only on write
+                yield ": keep-alive\n\n"
+                sent = time.time()
+            time.sleep(event_interval())
+
+
 class NodesTable(Table):
     def sort_url(self, col_id, reverse=False):
         pass
 
     def get_tr_attrs(self, item):
-        return {'class': item.css_class}
+        return {'class': item.css_class, 'id': 'node-{}'.format(item.node)}
 
     node = Col('Node')
     order_id = Col('Order id')
@@ -65,20 +198,35 @@ def create_app():
     @app.route('/', methods=('GET', 'POST'))
     @requires_auth
     def index():
-        nodes_content = []
-        groups = defaultdict(list)
-        for obj in Nodes.get_nodes_arr():
-            groups[obj.tag].append(obj)
-
-            nodes_content = [{
-                'node_tag': tag,
-                'predicted_price': Config.formatted_price_for_tag(tag),
-                'nodes_table': NodesTable([node.as_table_item for node in nodes],
-                                          classes=['table', 'table-striped', 'table-bordered'])
-            }
-                for tag, nodes in groups.items()]
-
-        return render_template('index.html', nodes=nodes_content, token_balance=Config.balance)
+        page, etag = Dashboard.snapshot()
+        response = make_response(page)
+        response.set_etag(etag)
+        return response.make_conditional(request)
+
+    @app.route('/events')
+    @requires_auth
+    def events():
+        return Response(LiveRows.stream(), mimetype="text/event-stream",
+                        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+    @app.route('/drain/<tag>', methods=('POST',))
+    @requires_auth
+    def drain(tag):
+        if not same_origin() or not valid_csrf_token():
+            return Response("Invalid request origin or token\n", 403)
+        if not SonmHttpServer.drain:
+            return Response("Drain is not available\n", 503)
+        if tag not in Nodes.get_tags():
+            return Response("Unknown tag {}\n".format(tag), 404)
+        threading.Thread(target=SonmHttpServer.drain, args=(tag,), name="drain", daemon=True).start()
+        return redirect("/", code=303)
+
+    @app.route('/metrics')
+    @requires_auth
+    def metrics():
+        lines = Metrics.render_nodes(Nodes.get_nodes_arr(), Nodes.get_state_counts(), list(State),
+                                     State.WORK_COMPLETED) + Metrics.render_api()
+        return Response("\n".join(lines) + "\n", mimetype="text/plain; version=0.0.4")
 
     return app
 
@@ -1,73 +1,252 @@
 import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from genericpath import isfile
 from os import listdir
 from os.path import join
 
+from source.breaker import CircuitOpenError
+from source.retry import RetryPolicy
 from source.sonmapi import SonmApi
-from source.utils import Nodes
+from source.utils import Nodes, parse_price, dump_file
 from source.config import Config
+from source.journal import Journal
+from source.reconciler import Reconciler
 from source.worknode import WorkNode, State
 
 logger = logging.getLogger("monitor")
 
 
-def reload_config(sonm_api: SonmApi):
-    Config.load_config()
+def reload_config(sonm_api: SonmApi, supervisor=None):
+    diff = Config.load_config()
+    if diff.changed_bids:
+        logger.info("Hardware requirements changed for tags: {}".format(", ".join(sorted(diff.changed_bids))))
+        Config.load_prices(sonm_api, diff.changed_bids)
+    for node_tag in diff.changed:
+        if Nodes.has_node(node_tag):
+            Nodes.get_node(node_tag).reload_config()
+    append_missed_nodes(sonm_api, {node_tag: Config.node_configs[node_tag] for node_tag in diff.added})
+    place_orders([Nodes.get_node(node_tag) for node_tag in diff.added if Nodes.has_node(node_tag)])
+    if diff.added:
+        # New orders get into reconciler snapshot right away, nodes poll them without asking node api
+        Reconciler.tick(sonm_api)
+    if supervisor:
+        supervisor.on_config_change(diff)
+
+
+def refresh_prices(sonm_api: SonmApi):
     Config.load_prices(sonm_api)
-    append_missed_nodes(sonm_api, Config.node_configs)
 
 
 def check_balance(sonm_api: SonmApi):
-    Config.balance = sonm_api.token_balance()
+    try:
+        Config.balance = sonm_api.token_balance()
+    except CircuitOpenError as e:
+        logger.warning("Cannot check balance: {}".format(e))
+
+
+def when_available(fn, *args):
+    # Node api may be down on start, recovery waits for the next breaker probe instead of failing
+    while True:
+        try:
+            return fn(*args)
+        except CircuitOpenError as e:
+            logger.warning("Cannot {}: {}".format(fn.__name__.replace("_", " "), e))
+            if RetryPolicy.wait(e.retry_in):
+                raise
 
 
 def append_missed_nodes(sonm_api, node_configs):
     for node_tag, node_config in node_configs.items():
-        if node_tag not in Nodes.get_nodes_keys():
+        if not Nodes.has_node(node_tag):
             Nodes.add_node(WorkNode.create_empty(sonm_api, node_tag))
 
 
-def init_nodes_state(sonm_api):
-    nodes_num_ = len(Config.node_configs)
+def order_workers():
+    return int(Config.base_config["order_workers"]) if "order_workers" in Config.base_config else 10
+
+
+def place_orders(nodes_):
+    # New nodes of one tag share price prediction and bid, their orders are placed in parallel
+    by_tag = {}
+    for node in nodes_:
+        if node.status in [State.START, State.CREATE_ORDER]:
+            by_tag.setdefault(node.tag, []).append(node)
+    for tag, tag_nodes in by_tag.items():
+        started = time.time()
+        price_, predicted_, predicted_w_coeff_ = tag_nodes[0].get_price()
+        dump_file(tag_nodes[0].create_bid(price_), "out/orders/{}.yaml".format(tag))
+        logger.info("Placing {} orders for tag {}: predicted price is {:.4f} USD/h, with coefficient {:.4f} USD/h, "
+                    "order price is {}".format(len(tag_nodes), tag, predicted_, predicted_w_coeff_,
+                                               tag_nodes[0].price))
+        with ThreadPoolExecutor(max_workers=order_workers(), thread_name_prefix="order") as executor:
+            results_ = list(executor.map(partial(place_node_order, price_), tag_nodes))
+        logger.info("Placed {} of {} orders for tag {} in {:.1f} sec"
+                    .format(results_.count(True), len(tag_nodes), tag, time.time() - started))
+
+
+def place_node_order(price_, node):
+    # Failed nodes are left in CREATE_ORDER state and retry on their own
+    try:
+        return node.place_order(node.create_bid(price_))
+    except Exception as e:
+        logger.error("Batch order for Node {} failed: {}".format(node.node_tag, e))
+        return False
+
+
+def recovery_workers():
+    return int(Config.base_config["recovery_workers"]) if "recovery_workers" in Config.base_config else 10
+
+
+def fetch_deal_details(sonm_api, deal):
+    deal_status = sonm_api.deal_status(deal["id"])
+    if not deal_status:
+        return deal, None, None
+    return deal, deal_status, sonm_api.order_status(deal_status["bid_id"])
+
+
+def init_nodes_state(sonm_api, verify_async=True):
+    # Only nodes which were placing orders need node api to be restored, others come from journal as is
+    restored, unplaced = when_available(restore_nodes_state, sonm_api)
+    if not restored:
+        when_available(recover_nodes_state, sonm_api)
+    elif verify_async and not unplaced:
+        threading.Thread(target=when_available, args=(verify_nodes_state, sonm_api), name="journal-verify",
+                         daemon=True).start()
+    else:
+        # Orders placed right before crash may be matched, their deals are adopted before nodes place new orders
+        when_available(verify_nodes_state, sonm_api)
+
+
+def restore_nodes_state(sonm_api):
+    # Nodes are restored from local journal, api is asked only for orders which may be placed before crash
+    started = time.time()
+    rows = [row for row in Journal.load() if row["node_tag"] in Config.node_configs and
+            row["status"] not in [State.START.name, State.WORK_COMPLETED.name]]
+    if len(rows) == 0:
+        return False, 0
+    placing_ = [row for row in rows if row["status"] == State.PLACING_ORDER.name]
+    unplaced = 0
+    orders_by_tag = {}
+    if placing_:
+        orders_ = sonm_api.order_list(2 * Config.fleet_size)
+        orders_by_tag = {order_["tag"]: order_ for order_ in orders_["orders"] or []}
+    for row in rows:
+        status = State[row["status"]]
+        if status == State.PLACING_ORDER:
+            order_ = orders_by_tag.get(row["node_tag"])
+            status = State.AWAITING_DEAL if order_ else State.CREATE_ORDER
+            row["bid_id"] = order_["id"] if order_ else ""
+            # Order may be already matched, it's not on the market then
+            unplaced += 0 if order_ else 1
+        price = parse_price(row["price"].replace(" ", "")) if row["price"] else ""
+        node_ = WorkNode(status, sonm_api, row["node_tag"], row["deal_id"], row["task_id"], row["bid_id"], price)
+        Journal.record(node_)
+        Nodes.add_node(node_)
+    append_missed_nodes(sonm_api, Config.node_configs)
+    logger.info("Restored {} nodes from journal in {:.1f} sec".format(len(rows), time.time() - started))
+    return True, unplaced
+
+
+def verify_nodes_state(sonm_api):
+    # Nodes check their own orders and deals on first step, here we only look for deals unknown to the journal
+    started = time.time()
+    # Deals of other shards are in the same journal, they aren't looked up again
+    known_deals = {node.deal_id for node in Nodes.get_nodes_arr() if node.deal_id} | \
+                  {row["deal_id"] for row in Journal.load() if row["deal_id"]}
+    deals_ = sonm_api.deal_list(max(2 * Config.fleet_size, len(known_deals) + Config.fleet_size))
+    if deals_ is None:
+        logger.error("Cannot verify journal: deal list is not available")
+        return
+    unknown_ = [deal for deal in deals_ if deal["id"] not in known_deals]
+    with ThreadPoolExecutor(max_workers=recovery_workers()) as executor:
+        details_ = list(executor.map(partial(fetch_deal_details, sonm_api), unknown_))
+    adopted = 0
+    for deal, deal_status, order_ in details_:
+        if not deal_status or not order_ or order_["tag"] not in Config.node_configs:
+            continue
+        # Order placed right before crash may be matched already, node takes the deal instead of placing a new order
+        node_ = Nodes.get_node(order_["tag"]) if Nodes.has_node(order_["tag"]) else None
+        status, task_id = deal_node_state(deal_status)
+        if node_ and node_.adopt_deal(status, deal["id"], task_id, deal_status["bid_id"], deal_status["price"]):
+            logger.info("Found deal, id {} (Node {})".format(deal["id"], order_["tag"]))
+            adopted += 1
+        elif Nodes.has_node(order_["tag"]):
+            logger.warning("Deal {} (Node {}) is open, but not tracked by journal. Close it manually"
+                           " or remove journal file to recover all deals from Sonm node"
+                           .format(deal["id"], order_["tag"]))
+    logger.info("Journal verified in {:.1f} sec, {} open deals, {} not tracked, {} adopted"
+                .format(time.time() - started, len(deals_), len(unknown_), adopted))
+
+
+def deal_node_state(deal_status):
+    if deal_status["running"]:
+        return State.TASK_RUNNING, deal_status["running"][0]
+    if deal_status["worker_offline"]:
+        logger.info(
+            "Seems like worker is offline: no respond for the resources and tasks request."
+            " Deal will be closed")
+        return State.TASK_FAILED, ""
+    return State.DEAL_OPENED, ""
+
+
+def recover_nodes_state(sonm_api):
+    started = time.time()
+    nodes_num_ = Config.fleet_size
+    recovered_deals = 0
+    recovered_orders = 0
     # get deals
     deals_ = sonm_api.deal_list(nodes_num_)
     if deals_:
-        for deal in deals_:
-            status = State.DEAL_OPENED
-            deal_status = sonm_api.deal_status(deal["id"])
-            order_ = sonm_api.order_status(deal_status["bid_id"])
-            for node_tag, node_config in Config.node_configs.items():
-                if node_tag == order_["tag"]:
-                    task_id = ""
-                    if deal_status["worker_offline"]:
-                        logger.info(
-                            "Seems like worker is offline: no respond for the resources and tasks request."
-                            " Deal will be closed")
-                        status = State.TASK_FAILED
-                    if deal_status["running"]:
-                        task_id = deal_status["running"][0]
-                        status = State.TASK_RUNNING
-                    bid_id_ = deal_status["bid_id"]
-                    price = deal_status["price"]
-                    node_ = WorkNode(status, sonm_api, order_["tag"], deal["id"], task_id, bid_id_, price)
-                    logger.info("Found deal, id {} (Node {})".format(deal["id"], order_["tag"]))
-                    Nodes.add_node(node_)
+        with ThreadPoolExecutor(max_workers=recovery_workers()) as executor:
+            details_ = list(executor.map(partial(fetch_deal_details, sonm_api), deals_))
+        for deal, deal_status, order_ in details_:
+            if not deal_status or not order_:
+                logger.error("Cannot retrieve status of deal {}, skipping it".format(deal["id"]))
+                continue
+            if order_["tag"] not in Config.node_configs:
+                continue
+            status, task_id = deal_node_state(deal_status)
+            bid_id_ = deal_status["bid_id"]
+            price = deal_status["price"]
+            node_ = WorkNode(status, sonm_api, order_["tag"], deal["id"], task_id, bid_id_, price)
+            logger.info("Found deal, id {} (Node {})".format(deal["id"], order_["tag"]))
+            Nodes.add_node(node_)
+            recovered_deals += 1
 
     # get orders
     orders_ = sonm_api.order_list(nodes_num_)
     if orders_ and orders_["orders"]:
         for order_ in list(orders_["orders"]):
+            if order_["tag"] not in Config.node_configs:
+                continue
             status = State.AWAITING_DEAL
-            for node_tag, node_config in Config.node_configs.items():
-                if node_tag == order_["tag"]:
-                    price = order_["price"]
-                    node_ = WorkNode(status, sonm_api, order_["tag"], "", "", order_["id"], price)
-                    logger.info("Found order, id {} (Node {})".format(order_["id"], order_["tag"]))
-                    Nodes.add_node(node_)
+            price = order_["price"]
+            node_ = WorkNode(status, sonm_api, order_["tag"], "", "", order_["id"], price)
+            logger.info("Found order, id {} (Node {})".format(order_["id"], order_["tag"]))
+            Nodes.add_node(node_)
+            recovered_orders += 1
     append_missed_nodes(sonm_api, Config.node_configs)
+    logger.info("Recovered {} deals and {} orders in {:.1f} sec"
+                .format(recovered_deals, recovered_orders, time.time() - started))
+
+
+def init_journal():
+    if "journal" in Config.base_config and not Config.base_config["journal"]:
+        return
+    Journal.open(Config.base_config["journal_file"] if "journal_file" in Config.base_config else "out/state.db")
+
+
+def split_rate_limit(rate_limit, per_host, processes):
+    # Coordinator and shards share node api budget, each process gets its part of rate, burst and requests in flight
+    return {"rate": float(rate_limit.get("rate", 50)) / processes,
+            "burst": max(1.0, float(rate_limit.get("burst", 100)) / processes),
+            "max_in_flight": max(1, int(rate_limit.get("max_in_flight", per_host)) // processes)}
 
 
-def init_sonm_api():
+def init_sonm_api(processes=1):
     timeout = int(Config.base_config["timeout"]) if "timeout" in Config.base_config else 60
 
     key_file_path = Config.base_config["ethereum"]["key_path"]
@@ -76,5 +255,12 @@ def init_sonm_api():
         raise Exception("Key storage doesn't contain any files")
     key_password = Config.base_config["ethereum"]["password"]
     node_addr = Config.base_config["node_address"]
-    sonm_api = SonmApi(join(key_file_path, keys[0]), key_password, node_addr, timeout)
+    pool_ = Config.base_config["connection_pool"] if "connection_pool" in Config.base_config else {}
+    retry_ = Config.base_config["retry"] if "retry" in Config.base_config else {}
+    rate_limit_ = Config.base_config["rate_limit"] if "rate_limit" in Config.base_config else {}
+    breaker_ = Config.base_config["circuit_breaker"] if "circuit_breaker" in Config.base_config else {}
+    rate_limit_ = split_rate_limit(rate_limit_, int(pool_.get("per_host", 20)), processes)
+    sonm_api = SonmApi(join(key_file_path, keys[0]), key_password, node_addr, timeout,
+                       int(pool_.get("size", 10)), int(pool_.get("per_host", 20)), retry_, rate_limit=rate_limit_,
+                       circuit_breaker=breaker_)
     return sonm_api
@@ -0,0 +1,53 @@
+import logging
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger("monitor")
+
+
+class Journal(object):
+    connection = None
+    lock = threading.Lock()
+
+    @staticmethod
+    def open(path):
+        connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute("CREATE TABLE IF NOT EXISTS nodes (node_tag TEXT PRIMARY KEY, status TEXT, bid_id TEXT, "
+                           "deal_id TEXT, task_id TEXT, price TEXT, updated REAL)")
+        Journal.connection = connection
+        logger.info("Node state journal: {}".format(path))
+
+    @staticmethod
+    def record(node):
+        if Journal.connection is None:
+            return
+        with Journal.lock:
+            Journal.connection.execute("INSERT OR REPLACE INTO nodes VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                       (node.node_tag, node.status.name, node.bid_id, node.deal_id, node.task_id,
+                                        node.price, time.time()))
+
+    @staticmethod
+    def remove(node_tag):
+        if Journal.connection is None:
+            return
+        with Journal.lock:
+            Journal.connection.execute("DELETE FROM nodes WHERE node_tag = ?", (node_tag,))
+
+    @staticmethod
+    def load():
+        if Journal.connection is None:
+            return []
+        with Journal.lock:
+            cursor = Journal.connection.execute("SELECT node_tag, status, bid_id, deal_id, task_id, price FROM nodes")
+            return [dict(zip(["node_tag", "status", "bid_id", "deal_id", "task_id", "price"], row))
+                    for row in cursor.fetchall()]
+
+    @staticmethod
+    def close():
+        if Journal.connection is not None:
+            with Journal.lock:
+                Journal.connection.close()
+                Journal.connection = None
@@ -0,0 +1,59 @@
+import heapq
+import itertools
+import threading
+import time
+
+# Requests which free or use paid resources go first, status polls and predictions wait.
+# Reconciler lists replace most status polls, they go with them so polls can't starve the snapshot
+PRIORITIES = {"deal_close": 0, "order_cancel": 0, "task_start": 0,
+              "order_create": 1, "deal_status": 1, "task_status": 1, "order_list": 1, "deal_list": 1,
+              "order_status": 2, "predict_bid": 2, "token_balance": 2}
+
+
+class ApiLimiter(object):
+    # Token bucket (rate, burst) and max requests in flight, shared by all threads using one SonmApi.
+    # Waiting requests are let through by priority, then in order of arrival. rate 0 means no rate limit
+    def __init__(self, rate=50, burst=100, max_in_flight=20):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.max_in_flight = int(max_in_flight)
+        self.tokens = self.burst
+        self.updated = time.time()
+        self.in_flight = 0
+        self.waiters = []
+        self.counter = itertools.count()
+        self.condition = threading.Condition()
+
+    def token_wait(self):
+        if self.rate <= 0:
+            return 0
+        now = time.time()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return 0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def acquire(self, endpoint):
+        # Returns time spent in queue
+        started = time.time()
+        entry = (PRIORITIES.get(endpoint, 1), next(self.counter))
+        with self.condition:
+            heapq.heappush(self.waiters, entry)
+            while True:
+                if self.waiters[0] == entry and self.in_flight < self.max_in_flight:
+                    wait_ = self.token_wait()
+                    if wait_ <= 0:
+                        break
+                    self.condition.wait(wait_)
+                else:
+                    self.condition.wait()
+            heapq.heappop(self.waiters)
+            if self.rate > 0:
+                self.tokens -= 1
+            self.in_flight += 1
+            self.condition.notify_all()
+        return time.time() - started
+
+    def release(self):
+        with self.condition:
+            self.in_flight -= 1
+            self.condition.notify_all()
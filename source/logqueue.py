@@ -0,0 +1,99 @@
+import atexit
+import logging
+import multiprocessing
+import queue
+from logging.handlers import QueueHandler, QueueListener
+
+
+class RoutedQueueHandler(QueueHandler):
+    # Records of all loggers share one queue, route tells listener which handlers the record belongs to
+    def __init__(self, queue_, route):
+        super().__init__(queue_)
+        self.route = route
+
+    def enqueue(self, record):
+        self.queue.put_nowait((self.route, record))
+
+
+class RoutedQueueListener(QueueListener):
+    def __init__(self, queue_, routes):
+        super().__init__(queue_)
+        self.routes = routes
+
+    def handle(self, item):
+        route, record = item
+        for handler in self.routes[route]:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+
+class LogQueue(object):
+    # Handlers configured in logging.yaml are moved behind a queue: node threads only put records to it,
+    # formatting and file writes are done by one listener thread
+    queue_handlers = []
+    routes = {}
+    listener = None
+    # Coordinator side listeners of shard processes and the queue of this shard process
+    shard_listeners = {}
+    shard_queue = None
+
+    @staticmethod
+    def install():
+        loggers_ = [logging.getLogger()] + [logger_ for logger_ in logging.root.manager.loggerDict.values()
+                                            if isinstance(logger_, logging.Logger)]
+        queue_ = queue.Queue(-1)
+        for logger_ in loggers_:
+            handlers_ = [handler for handler in logger_.handlers if not isinstance(handler, QueueHandler)]
+            if not handlers_:
+                continue
+            for handler in handlers_:
+                logger_.removeHandler(handler)
+            queue_handler = RoutedQueueHandler(queue_, logger_.name)
+            logger_.addHandler(queue_handler)
+            LogQueue.queue_handlers.append(queue_handler)
+            LogQueue.routes[logger_.name] = handlers_
+        LogQueue.start(queue_)
+        atexit.register(LogQueue.stop)
+
+    @staticmethod
+    def start(queue_):
+        LogQueue.listener = RoutedQueueListener(queue_, LogQueue.routes)
+        LogQueue.listener.start()
+
+    @staticmethod
+    def open_shard(shard):
+        # Shard processes don't write log files, their records are written by coordinator to the same handlers.
+        # Restarted shard gets a new queue: killed process may leave the old one locked, its listener is left as is
+        queue_ = multiprocessing.Queue(-1)
+        listener = RoutedQueueListener(queue_, LogQueue.routes)
+        listener.start()
+        LogQueue.shard_listeners[shard] = listener
+        return queue_
+
+    @staticmethod
+    def close_shard(shard):
+        # Called after shard process exited normally, writes all its records before return
+        listener = LogQueue.shard_listeners.pop(shard, None)
+        if listener:
+            listener.stop()
+
+    @staticmethod
+    def restart(queue_):
+        # Listener thread doesn't survive fork, shard process sends its records to coordinator instead.
+        # Old listener isn't stopped: its queue may be left locked by the parent process
+        for queue_handler in LogQueue.queue_handlers:
+            queue_handler.queue = queue_
+        LogQueue.listener = None
+        LogQueue.shard_listeners = {}
+        LogQueue.shard_queue = queue_
+
+    @staticmethod
+    def stop():
+        # Writes all queued records before return
+        if LogQueue.listener:
+            LogQueue.listener.stop()
+            LogQueue.listener = None
+        if LogQueue.shard_queue:
+            LogQueue.shard_queue.close()
+            LogQueue.shard_queue.join_thread()
+            LogQueue.shard_queue = None
@@ -0,0 +1,123 @@
+import copy
+import threading
+import time
+
+BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class Metrics(object):
+    lock = threading.Lock()
+    latency = {}
+    queue_wait = {}
+    errors = {}
+    retries = {}
+    shards = {}
+
+    @staticmethod
+    def observe(histograms, method, seconds):
+        with Metrics.lock:
+            if method not in histograms:
+                histograms[method] = {"buckets": [0] * len(BUCKETS), "sum": 0.0, "count": 0}
+            histogram_ = histograms[method]
+            for i, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    histogram_["buckets"][i] += 1
+            histogram_["sum"] += seconds
+            histogram_["count"] += 1
+
+    @staticmethod
+    def observe_latency(method, seconds):
+        Metrics.observe(Metrics.latency, method, seconds)
+
+    @staticmethod
+    def observe_queue_wait(method, seconds):
+        Metrics.observe(Metrics.queue_wait, method, seconds)
+
+    @staticmethod
+    def inc_error(method):
+        with Metrics.lock:
+            Metrics.errors[method] = Metrics.errors.get(method, 0) + 1
+
+    @staticmethod
+    def inc_retry(method):
+        with Metrics.lock:
+            Metrics.retries[method] = Metrics.retries.get(method, 0) + 1
+
+    @staticmethod
+    def snapshot():
+        with Metrics.lock:
+            return copy.deepcopy({"latency": Metrics.latency, "queue_wait": Metrics.queue_wait,
+                                  "errors": Metrics.errors, "retries": Metrics.retries})
+
+    @staticmethod
+    def update_shard(shard, snapshot_):
+        with Metrics.lock:
+            Metrics.shards[shard] = snapshot_
+
+    @staticmethod
+    def merged():
+        # Metrics sent by shard processes are added to metrics of this process
+        latency = copy.deepcopy(Metrics.latency)
+        queue_wait = copy.deepcopy(Metrics.queue_wait)
+        errors = dict(Metrics.errors)
+        retries = dict(Metrics.retries)
+        for snapshot_ in Metrics.shards.values():
+            for totals, histograms in [(latency, snapshot_["latency"]), (queue_wait, snapshot_["queue_wait"])]:
+                for method, histogram_ in histograms.items():
+                    total_ = totals.setdefault(method, {"buckets": [0] * len(BUCKETS), "sum": 0.0, "count": 0})
+                    total_["buckets"] = [a + b for a, b in zip(total_["buckets"], histogram_["buckets"])]
+                    total_["sum"] += histogram_["sum"]
+                    total_["count"] += histogram_["count"]
+            for method, count in snapshot_["errors"].items():
+                errors[method] = errors.get(method, 0) + count
+            for method, count in snapshot_["retries"].items():
+                retries[method] = retries.get(method, 0) + count
+        return latency, queue_wait, errors, retries
+
+    @staticmethod
+    def render_histograms(name, help_, histograms):
+        lines = ["# HELP {} {}".format(name, help_),
+                 "# TYPE {} histogram".format(name)]
+        for method, histogram_ in sorted(histograms.items()):
+            for bound, count in zip(BUCKETS, histogram_["buckets"]):
+                lines.append('{}_bucket{{method="{}",le="{}"}} {}'.format(name, method, bound, count))
+            lines.append('{}_bucket{{method="{}",le="+Inf"}} {}'.format(name, method, histogram_["count"]))
+            lines.append('{}_sum{{method="{}"}} {:.6f}'.format(name, method, histogram_["sum"]))
+            lines.append('{}_count{{method="{}"}} {}'.format(name, method, histogram_["count"]))
+        return lines
+
+    @staticmethod
+    def render_api():
+        with Metrics.lock:
+            latency, queue_wait, errors, retries = Metrics.merged()
+            lines = Metrics.render_histograms("sonm_api_request_duration_seconds",
+                                              "Duration of single Node API request attempt.", latency)
+            lines += Metrics.render_histograms("sonm_api_queue_wait_seconds",
+                                               "Time Node API request waited for rate limiter.", queue_wait)
+            lines += ["# HELP sonm_api_errors_total Failed Node API request attempts.",
+                      "# TYPE sonm_api_errors_total counter"]
+            lines += ['sonm_api_errors_total{{method="{}"}} {}'.format(method, count)
+                      for method, count in sorted(errors.items())]
+            lines += ["# HELP sonm_api_retries_total Node API requests retried after failure.",
+                      "# TYPE sonm_api_retries_total counter"]
+            lines += ['sonm_api_retries_total{{method="{}"}} {}'.format(method, count)
+                      for method, count in sorted(retries.items())]
+        return lines
+
+    @staticmethod
+    def render_nodes(nodes, counts, states, completed_state):
+        lag = {}
+        now = time.time()
+        for node in nodes:
+            if node.status != completed_state:
+                lag[node.tag] = max(lag.get(node.tag, 0), now - node.last_heartbeat)
+        lines = ["# HELP taskman_nodes Number of nodes in each state.",
+                 "# TYPE taskman_nodes gauge"]
+        for tag in sorted({tag for tag, state in counts}):
+            lines += ['taskman_nodes{{tag="{}",state="{}"}} {}'.format(tag, state.name, counts.get((tag, state), 0))
+                      for state in states]
+        lines += ["# HELP taskman_heartbeat_lag_seconds Max time since last heartbeat of running nodes.",
+                  "# TYPE taskman_heartbeat_lag_seconds gauge"]
+        lines += ['taskman_heartbeat_lag_seconds{{tag="{}"}} {:.3f}'.format(tag, seconds)
+                  for tag, seconds in sorted(lag.items())]
+        return lines
@@ -0,0 +1,55 @@
+import threading
+import time
+
+from source.config import Config
+
+# min and max poll interval (sec) for each kind of state
+DEFAULTS = {"awaiting_deal": (5, 60), "spooling": (5, 30), "running": (60, 300)}
+
+
+def polling_config():
+    return Config.base_config["polling"] if "polling" in Config.base_config else {}
+
+
+class Polling(object):
+    # Interval grows with the time node spent in its state: fresh orders and spooling tasks are checked often,
+    # long running tasks rarely. Deals opened or closed meanwhile are found by reconciler, it wakes nodes up
+    @staticmethod
+    def bounds(kind):
+        low, high = DEFAULTS[kind]
+        bounds_ = polling_config().get(kind) or {}
+        return float(bounds_.get("min", low)), float(bounds_.get("max", high))
+
+    @staticmethod
+    def interval(kind, age):
+        low, high = Polling.bounds(kind)
+        return min(max(age * float(polling_config().get("ratio", 0.1)), low), high)
+
+    @staticmethod
+    def api_interval():
+        # Statuses missing in reconciler snapshot are asked from node api at the slowest awaiting_deal cadence,
+        # fast polls are answered by the snapshot only
+        return Polling.bounds("awaiting_deal")[1]
+
+
+class PollWheel(object):
+    # Timer wheel with one second slots. Poll is moved to the least loaded slot within spread window,
+    # so nodes which changed state together don't poll node api in bursts
+    lock = threading.Lock()
+    slots = {}
+    pruned = 0
+
+    @staticmethod
+    def spread(delay):
+        window = int(min(delay * 0.25, float(polling_config().get("spread", 10))))
+        if window < 1:
+            return delay
+        now = time.time()
+        first = int(now + delay)
+        with PollWheel.lock:
+            if PollWheel.pruned != int(now):
+                PollWheel.slots = {slot: count for slot, count in PollWheel.slots.items() if slot >= int(now)}
+                PollWheel.pruned = int(now)
+            slot = min(range(first, first + window + 1), key=lambda slot_: PollWheel.slots.get(slot_, 0))
+            PollWheel.slots[slot] = PollWheel.slots.get(slot, 0) + 1
+        return delay + slot - first
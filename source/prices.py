@@ -0,0 +1,88 @@
+import hashlib
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from source.breaker import CircuitOpenError
+
+logger = logging.getLogger("monitor")
+
+
+def resources_key(resources):
+    return hashlib.sha1(json.dumps(resources, sort_keys=True).encode()).hexdigest()
+
+
+def predict(sonm_api, resources):
+    try:
+        return sonm_api.predict_bid(resources)
+    except CircuitOpenError:
+        return None
+
+
+class PriceCache(object):
+    entries = {}
+    lock = threading.Lock()
+    ttl = 600
+    max_workers = 4
+    # Shard processes don't predict prices, coordinator sends them its entries
+    shared = False
+
+    @staticmethod
+    def get(key):
+        entry_ = PriceCache.entries.get(key)
+        return entry_["price"] if entry_ else None
+
+    @staticmethod
+    def add(resources):
+        key = resources_key(resources)
+        with PriceCache.lock:
+            if key not in PriceCache.entries:
+                PriceCache.entries[key] = {"resources": resources, "price": None, "updated": 0}
+        return key
+
+    @staticmethod
+    def retain(keys):
+        with PriceCache.lock:
+            for key in [key for key in PriceCache.entries if key not in keys]:
+                del PriceCache.entries[key]
+
+    @staticmethod
+    def expired(keys=None):
+        now = time.time()
+        with PriceCache.lock:
+            return [(key, entry_["resources"]) for key, entry_ in PriceCache.entries.items()
+                    if (keys is None or key in keys) and now - entry_["updated"] >= PriceCache.ttl]
+
+    @staticmethod
+    def refresh(sonm_api, keys=None):
+        # Identical resources of different tags share one entry, so each spec is predicted once
+        expired_ = PriceCache.expired(keys)
+        if PriceCache.shared or len(expired_) == 0:
+            return 0
+        with ThreadPoolExecutor(max_workers=min(PriceCache.max_workers, len(expired_))) as executor:
+            predicted_ = executor.map(partial(predict, sonm_api), [resources for key, resources in expired_])
+            for (key, resources), price_ in zip(expired_, predicted_):
+                if price_ is None:
+                    logger.error("Cannot predict price, previous value is kept until next refresh")
+                    continue
+                with PriceCache.lock:
+                    if key in PriceCache.entries:
+                        PriceCache.entries[key].update({"price": price_, "updated": time.time()})
+        logger.debug("Refreshed {} predicted prices".format(len(expired_)))
+        return len(expired_)
+
+    @staticmethod
+    def export():
+        with PriceCache.lock:
+            return {key: dict(entry_) for key, entry_ in PriceCache.entries.items()}
+
+    @staticmethod
+    def load(entries):
+        # Entries of bids which shard doesn't use are dropped by retain on its next config load
+        with PriceCache.lock:
+            for key, entry_ in entries.items():
+                if entry_["price"] is not None:
+                    PriceCache.entries[key] = entry_
@@ -0,0 +1,93 @@
+import logging
+import time
+
+from source.breaker import CircuitOpenError
+from source.config import Config
+from source.utils import Nodes
+
+logger = logging.getLogger("monitor")
+
+
+def reconcile_interval():
+    return int(Config.base_config["reconcile_interval"]) if "reconcile_interval" in Config.base_config else 60
+
+
+class Reconciler(object):
+    orders = {}
+    orders_by_tag = {}
+    deals = {}
+    deals_by_bid = {}
+    known_deals = set()
+    orders_complete = False
+    deals_complete = False
+    updated = 0
+
+    @staticmethod
+    def tick(sonm_api):
+        snapshot_ = Reconciler.fetch(sonm_api)
+        if snapshot_:
+            Reconciler.load(*snapshot_)
+
+    @staticmethod
+    def fetch(sonm_api):
+        # Limit is doubled, so a full page means that list was truncated. Lists contain orders of all shards
+        limit = 2 * max(Config.fleet_size, 1)
+        try:
+            orders_ = sonm_api.order_list(limit)
+            deals_ = sonm_api.deal_list(limit)
+        except CircuitOpenError as e:
+            logger.warning("Skip reconcile: {}".format(e))
+            return None
+        if orders_["orders"] is None or deals_ is None:
+            logger.error("Cannot retrieve orders and deals, nodes will check their status on their own")
+            Reconciler.updated = 0
+            return None
+        return orders_["orders"], deals_, limit
+
+    @staticmethod
+    def load(orders_, deals_, limit):
+        # Shard processes get snapshot fetched by coordinator
+        Reconciler.known_deals = set(Reconciler.deals.keys())
+        Reconciler.orders = {order_["id"]: order_ for order_ in orders_}
+        Reconciler.orders_by_tag = {order_["tag"]: order_ for order_ in orders_}
+        Reconciler.deals = {deal_["id"]: deal_ for deal_ in deals_}
+        Reconciler.deals_by_bid = {deal_["bid_id"]: deal_ for deal_ in deals_ if deal_["bid_id"]}
+        Reconciler.orders_complete = len(orders_) < limit
+        Reconciler.deals_complete = len(deals_) < limit
+        Reconciler.updated = time.time()
+        logger.debug("Reconciled {} orders and {} deals".format(len(Reconciler.orders), len(Reconciler.deals)))
+        Reconciler.wake_changed_nodes()
+
+    @staticmethod
+    def wake_changed_nodes():
+        # Nodes with new deal or closed deal shouldn't wait for their next poll
+        for node in Nodes.get_nodes_arr():
+            if (node.bid_id and node.bid_id in Reconciler.deals_by_bid and not node.deal_id) or \
+                    (Reconciler.deal_status(node.deal_id) or {}).get("status") == 2:
+                node.wake()
+
+    @staticmethod
+    def is_fresh():
+        return time.time() - Reconciler.updated < 2 * reconcile_interval()
+
+    @staticmethod
+    def order_status(order_id):
+        # None means that order state can't be proved by the last snapshot, caller should ask node api
+        if not order_id or not Reconciler.is_fresh():
+            return None
+        if order_id in Reconciler.orders:
+            return {"orderStatus": 2, "tag": Reconciler.orders[order_id]["tag"], "dealID": "0"}
+        if order_id in Reconciler.deals_by_bid:
+            return {"orderStatus": 1, "tag": None, "dealID": Reconciler.deals_by_bid[order_id]["id"]}
+        return None
+
+    @staticmethod
+    def deal_status(deal_id):
+        if not deal_id or not Reconciler.is_fresh():
+            return None
+        if deal_id in Reconciler.deals:
+            return {"status": 1}
+        # Deal is closed only if previous snapshot has seen it, newer deals are unknown yet
+        if Reconciler.deals_complete and deal_id in Reconciler.known_deals:
+            return {"status": 2}
+        return None
@@ -0,0 +1,104 @@
+import asyncio
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+SHUTDOWN = threading.Event()
+# Stop event of the node whose call is running: each thread and each asyncio task sees its own value
+_event = ContextVar("interrupt_event", default=None)
+# Asyncio event of the node, it is set from other threads together with stop event
+_wakeup = ContextVar("interrupt_wakeup", default=None)
+
+
+@contextmanager
+def interruptible(event, wakeup=None):
+    # Retry waits in this thread or task are cut short when event is set (e.g. node stop)
+    token = _event.set(event)
+    wakeup_token = _wakeup.set(wakeup)
+    try:
+        yield
+    finally:
+        _wakeup.reset(wakeup_token)
+        _event.reset(token)
+
+
+def is_interrupted():
+    event_ = _event.get()
+    return SHUTDOWN.is_set() or (event_ is not None and event_.is_set())
+
+
+class RetryPolicy(object):
+    def __init__(self, attempts=3, backoff=1, max_backoff=10, deadline=30, jitter=0.5):
+        self.attempts = int(attempts)
+        self.backoff = float(backoff)
+        self.max_backoff = float(max_backoff)
+        self.deadline = float(deadline)
+        self.jitter = float(jitter)
+
+    def with_config(self, config):
+        params = {"attempts": self.attempts, "backoff": self.backoff, "max_backoff": self.max_backoff,
+                  "deadline": self.deadline, "jitter": self.jitter}
+        params.update({key: value for key, value in config.items() if key in params})
+        return RetryPolicy(**params)
+
+    def start(self):
+        return Retries(self)
+
+    @staticmethod
+    def wait(delay):
+        # Returns True if the wait was interrupted and the call should give up.
+        # Nodes set their own events on shutdown, so one event is enough to wait on
+        event_ = _event.get()
+        (event_ if event_ is not None else SHUTDOWN).wait(delay)
+        return is_interrupted()
+
+    @staticmethod
+    async def wait_async(delay):
+        # Stop events are threading events, nodes wake their asyncio event when they are stopped.
+        # Without it stop is checked once per second
+        wakeup_ = _wakeup.get()
+        deadline = time.time() + delay
+        while not is_interrupted():
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            if wakeup_ is None:
+                await asyncio.sleep(min(remaining, 1))
+                continue
+            try:
+                await asyncio.wait_for(wakeup_.wait(), remaining)
+            except asyncio.TimeoutError:
+                break
+            if not is_interrupted():
+                # Node was woken for a state change, it is checked after the retried call anyway
+                wakeup_.clear()
+        return is_interrupted()
+
+
+class Retries(object):
+    # Retries of one call. Deadline is counted from the call start, time of attempts included
+    def __init__(self, policy):
+        self.policy = policy
+        self.started = time.time()
+        self.retries = 0
+
+    def remaining(self):
+        return self.policy.deadline - (time.time() - self.started)
+
+    def timeout(self, timeout):
+        # First attempt gets full request timeout, retries get what is left of deadline
+        if self.retries == 0:
+            return timeout
+        return max(min(timeout, self.remaining()), 1)
+
+    def next_delay(self):
+        # None means that the call should give up
+        remaining = self.remaining()
+        if self.retries >= self.policy.attempts or remaining <= 1:
+            return None
+        delay = min(self.policy.backoff * 2 ** self.retries, self.policy.max_backoff)
+        delay = random.uniform(delay * (1 - self.policy.jitter), delay)
+        self.retries += 1
+        return min(delay, remaining - 1)
@@ -0,0 +1,234 @@
+import logging
+import multiprocessing
+import queue
+import threading
+import time
+
+from source.config import Config
+from source.logqueue import LogQueue
+from source.metrics import Metrics
+from source.prices import PriceCache
+from source.reconciler import Reconciler
+from source.utils import Nodes
+from source.worknode import State, WorkNode
+
+logger = logging.getLogger("monitor")
+
+
+# Data sent by coordinator to all shards, they aren't logged on every delivery
+SYNC_COMMANDS = ["prices", "snapshot"]
+
+
+def shards_number():
+    return int(Config.base_config["shards"]) if "shards" in Config.base_config else 1
+
+
+def shard_restarts():
+    return int(Config.base_config["shard_restarts"]) if "shard_restarts" in Config.base_config else 3
+
+
+def node_record(node):
+    return {"node_tag": node.node_tag, "bid_id": node.bid_id, "price": node.price, "deal_id": node.deal_id,
+            "task_id": node.task_id, "task_uptime": node.task_uptime, "status": node.status.name,
+            "last_heartbeat": node.last_heartbeat}
+
+
+class RemoteNode(object):
+    # Read-only copy of a node which runs in shard process, used by dashboard and metrics of coordinator
+    __slots__ = ("shard", "node_tag", "tag", "bid_id", "price", "deal_id", "task_id", "task_uptime", "status",
+                 "last_heartbeat")
+
+    def __init__(self, shard, record):
+        self.shard = shard
+        self.node_tag = record["node_tag"]
+        self.tag = self.node_tag.split('_')[0]
+        self.update(record)
+
+    def update(self, record):
+        self.bid_id = record["bid_id"]
+        self.price = record["price"]
+        self.deal_id = record["deal_id"]
+        self.task_id = record["task_id"]
+        self.task_uptime = record["task_uptime"]
+        self.status = State[record["status"]]
+        self.last_heartbeat = record["last_heartbeat"]
+
+    as_table_item = WorkNode.as_table_item
+
+
+class ShardLink(object):
+    # Shard side of the channel: sends changed node records to coordinator and runs its commands
+    def __init__(self, shard, states, commands, interval=1, metrics_interval=10):
+        self.shard = shard
+        self.states = states
+        self.commands = commands
+        self.interval = interval
+        self.metrics_interval = metrics_interval
+        self.sent = {}
+        self.metrics_sent = 0
+        self.stopped = threading.Event()
+
+    def start(self, handlers):
+        threading.Thread(target=self.publish_loop, name="shard-publish", daemon=True).start()
+        threading.Thread(target=self.listen, args=(handlers,), name="shard-commands", daemon=True).start()
+
+    def publish(self):
+        records = {node.node_tag: node_record(node) for node in Nodes.get_nodes_arr()}
+        changed = [record for node_tag, record in records.items() if self.sent.get(node_tag) != record]
+        removed = [node_tag for node_tag in self.sent if node_tag not in records]
+        if changed or removed:
+            self.states.put(("nodes", self.shard, changed, removed))
+        self.sent = records
+        if time.time() - self.metrics_sent >= self.metrics_interval:
+            self.states.put(("metrics", self.shard, Metrics.snapshot(), None))
+            self.metrics_sent = time.time()
+
+    def publish_loop(self):
+        while not self.stopped.wait(self.interval):
+            self.publish()
+
+    def listen(self, handlers):
+        while not self.stopped.is_set():
+            try:
+                command, args = self.commands.get(timeout=1)
+            except queue.Empty:
+                continue
+            if command not in SYNC_COMMANDS:
+                logger.info("Shard {} received command: {} {}".format(self.shard, command, " ".join(args)))
+            if command in handlers:
+                handlers[command](*args)
+
+    def close(self):
+        self.stopped.set()
+        self.metrics_sent = 0
+        self.publish()
+
+
+class Coordinator(object):
+    # Starts shard processes, collects their node states and broadcasts config reloads and stop.
+    # Prices and reconciler snapshot are fetched here once and sent to all shards
+    def __init__(self, shards, target):
+        self.shards = shards
+        self.target = target
+        self.states = multiprocessing.Queue()
+        self.commands = [multiprocessing.Queue() for _ in range(shards)]
+        self.processes = []
+        self.restarts = [0] * shards
+        self.stopping = False
+        self.finished = threading.Event()
+        self.collector = None
+
+    def start(self):
+        self.processes = [self.start_shard(shard) for shard in range(self.shards)]
+        logger.info("Started {} shard processes".format(self.shards))
+        self.collector = threading.Thread(target=self.collect, name="shard-collector", daemon=True)
+        self.collector.start()
+
+    def start_shard(self, shard):
+        process = multiprocessing.Process(target=self.target, name="shard-{}".format(shard),
+                                          args=(shard, self.shards, self.states, self.commands[shard],
+                                                PriceCache.export(), LogQueue.open_shard(shard)))
+        process.start()
+        return process
+
+    def is_alive(self):
+        return any(process.is_alive() for process in self.processes if process)
+
+    def check_shards(self):
+        # Shard exits with 0 when its work is completed, other exit codes mean that it crashed or was killed
+        for shard, process in enumerate(self.processes):
+            if self.stopping or not process or process.is_alive() or process.exitcode == 0:
+                continue
+            if self.restarts[shard] < shard_restarts():
+                self.restarts[shard] += 1
+                logger.error("Shard process {} exited with code {}, restarting it ({} of {})"
+                             .format(process.name, process.exitcode, self.restarts[shard], shard_restarts()))
+                self.processes[shard] = self.start_shard(shard)
+            else:
+                logger.error("Shard process {} exited with code {}, its nodes are removed from dashboard"
+                             .format(process.name, process.exitcode))
+                self.processes[shard] = None
+                self.drop_nodes(shard)
+
+    def drop_nodes(self, shard):
+        for node in Nodes.get_nodes_arr():
+            if node.shard == shard:
+                Nodes.remove_node(node.node_tag)
+        Nodes.touch()
+
+    def collect(self):
+        while True:
+            try:
+                kind, shard, data, removed = self.states.get(timeout=1)
+            except queue.Empty:
+                if self.finished.is_set():
+                    return
+                continue
+            if kind == "metrics":
+                Metrics.update_shard(shard, data)
+                continue
+            for record in data:
+                if Nodes.has_node(record["node_tag"]):
+                    node_ = Nodes.get_node(record["node_tag"])
+                    previous_ = node_.status
+                    node_.update(record)
+                    Nodes.on_status(node_, previous_)
+                else:
+                    Nodes.add_node(RemoteNode(shard, record))
+            for node_tag in removed:
+                if Nodes.has_node(node_tag):
+                    Nodes.remove_node(node_tag)
+            Nodes.touch()
+
+    def broadcast(self, command, *args):
+        # Removed shards don't read their queues anymore
+        for commands, process in zip(self.commands, self.processes):
+            if process:
+                commands.put((command, args))
+
+    def drain_tag(self, tag):
+        self.broadcast("drain", tag)
+
+    def refresh_prices(self, sonm_api):
+        if Config.load_prices(sonm_api):
+            self.broadcast("prices", PriceCache.export())
+
+    def reconcile(self, sonm_api):
+        snapshot_ = Reconciler.fetch(sonm_api)
+        if snapshot_:
+            self.broadcast("snapshot", *snapshot_)
+
+    def reload_config(self, sonm_api):
+        diff = Config.load_config()
+        if diff.changed_bids:
+            Config.load_prices(sonm_api, diff.changed_bids)
+            # Shards get prices of changed bids before they reload config
+            self.broadcast("prices", PriceCache.export())
+        if diff.added or diff.removed or diff.changed or diff.changed_bids:
+            logger.info("Configuration changed, reloading shards")
+            self.broadcast("reload")
+
+    def wait(self):
+        while True:
+            self.check_shards()
+            if not self.is_alive():
+                break
+            for process in self.processes:
+                if process:
+                    process.join(1)
+        self.finished.set()
+        self.collector.join()
+
+    def stop(self, timeout=60):
+        self.stopping = True
+        self.finished.set()
+        self.broadcast("stop")
+        deadline = time.time() + timeout
+        for process in [process for process in self.processes if process]:
+            process.join(max(deadline - time.time(), 0))
+            if process.is_alive():
+                logger.error("Shard process {} didn't stop in time, terminating it".format(process.name))
+                process.terminate()
+        for shard, process in enumerate(self.processes):
+            if process and process.exitcode == 0:
+                LogQueue.close_shard(shard)
@@ -1,32 +1,94 @@
+import asyncio
+import gzip
 import logging
 import subprocess
+import threading
 import time
-from functools import wraps
+from functools import wraps, partial
 
 from pytimeparse.timeparse import timeparse
 from sonm_pynode.main import Node
 
+from source.breaker import CircuitBreaker, CircuitOpenError
+from source.limiter import ApiLimiter
+from source.metrics import Metrics
+from source.retry import RetryPolicy
+from source.transport import PooledTransport
 from source.utils import convert_price, parse_tag, parse_price, Identity, get_sonmcli
 
 logger = logging.getLogger("monitor")
+# Timeout of the request sent by this thread, it is shortened for retries by what is left of call deadline
+_request = threading.local()
 
 
-def retry_on_status(_func=None, *, attempts=3, sleep_time=3):
+def retry_on_status(_func=None, **defaults):
     def decorator(fn):
+        endpoint = fn.__name__[:-len("_rest")] if fn.__name__.endswith("_rest") else fn.__name__
+        default_policy = RetryPolicy(**defaults)
+
+        def succeeded(r):
+            return r is not None and "status_code" in r and r["status_code"] == 200
+
+        def reachable(r):
+            # Client errors are answers of a working node, only connection failures and server errors count
+            return r is not None and "status_code" in r and 0 < r["status_code"] < 500
+
+        def measured(started, r):
+            Metrics.observe_latency(endpoint, time.time() - started)
+            if not succeeded(r):
+                Metrics.inc_error(endpoint)
+            return r
+
+        def attempt(self, timeout, *args, **kwargs):
+            self.breaker.before_call()
+            Metrics.observe_queue_wait(endpoint, self.limiter.acquire(endpoint))
+            started = time.time()
+            _request.timeout = timeout
+            try:
+                r = measured(started, fn(self, *args, **kwargs))
+            except Exception:
+                measured(started, None)
+                self.breaker.record(False)
+                raise
+            finally:
+                _request.timeout = None
+                self.limiter.release()
+            self.breaker.record(reachable(r))
+            return r
+
+        def failed(self, r):
+            if self.breaker.is_open():
+                raise CircuitOpenError(self.breaker.retry_in())
+            logger.error("Failed to execute {}: {}".format(fn.__name__, r))
+            return None
+
         @wraps(fn)
-        def wrapper(*args, **kwargs):
-            attempt = 1
+        def wrapper(self, *args, **kwargs):
+            retries = self.retry_policy(endpoint, default_policy).start()
             while True:
-                r = fn(*args, **kwargs)
-                if "status_code" in r and r["status_code"] == 200:
+                r = attempt(self, retries.timeout(self.timeout), *args, **kwargs)
+                if succeeded(r):
                     return r
-                if attempt > attempts:
-                    break
-                attempt += 1
-                time.sleep(sleep_time)
-            logger.error("Failed to execute {}: {}".format(fn.__name__, r))
-            return None
+                delay = retries.next_delay()
+                if delay is None or RetryPolicy.wait(delay):
+                    return failed(self, r)
+                Metrics.inc_retry(endpoint)
+
+        async def run_async(self, executor, *args, **kwargs):
+            # Same as wrapper, but waits between attempts on event loop: only requests take executor threads
+            loop = asyncio.get_event_loop()
+            retries = self.retry_policy(endpoint, default_policy).start()
+            while True:
+                r = await loop.run_in_executor(executor, partial(attempt, self, retries.timeout(self.timeout),
+                                                                 *args, **kwargs))
+                if succeeded(r):
+                    return r
+                delay = retries.next_delay()
+                if delay is None or await RetryPolicy.wait_async(delay):
+                    return failed(self, r)
+                Metrics.inc_retry(endpoint)
 
+        wrapper.run_async = run_async
         return wrapper
 
     if _func is None:
@@ -36,16 +98,43 @@ def retry_on_status(_func=None, *, attempts=3, sleep_time=3):
 
 
 class SonmApi:
-    def __init__(self, key_file: str, password: str, endpoint: str, timeout: int):
-        self.node = Node(key_file, password, endpoint)
+    def __init__(self, key_file: str, password: str, endpoint: str, timeout: int, pool_size=10, per_host=20,
+                 retry_config=None, node=None, rate_limit=None, circuit_breaker=None):
+        self.node = node if node else Node(key_file, password, endpoint)
+        self.retry_config = retry_config if retry_config else {}
+        self.retry_policies = {}
+        self.transport = PooledTransport(pool_size, per_host)
+        self.transport.install(self.node)
+        rate_limit = rate_limit if rate_limit else {}
+        self.limiter = ApiLimiter(rate_limit.get("rate", 50), rate_limit.get("burst", 100),
+                                  rate_limit.get("max_in_flight", per_host))
+        circuit_breaker = circuit_breaker if circuit_breaker else {}
+        self.breaker = CircuitBreaker(circuit_breaker.get("threshold", 5), circuit_breaker.get("reset_timeout", 30))
         self.logger = logging.getLogger("monitor")
         self.timeout = timeout
         self.logger.info("Sonm api instance created:\n"
                          "\tEth key location: {}\n"
                          "\tEth address: {}\n"
                          "\tSonm node endpoint: {}\n"
-                         "\tDefault timeout: {} sec"
-                         .format(key_file, self.node.eth_addr, endpoint, timeout))
+                         "\tDefault timeout: {} sec\n"
+                         "\tConnection pool: {} hosts, {} connections per host\n"
+                         "\tRate limit: {} requests/sec, burst {}, {} requests in flight\n"
+                         "\tCircuit breaker: opens after {} failed requests, probe in {} sec"
+                         .format(key_file, self.node.eth_addr, endpoint, timeout, pool_size, per_host,
+                                 self.limiter.rate, self.limiter.burst, self.limiter.max_in_flight,
+                                 self.breaker.threshold, self.breaker.reset_timeout))
+
+    def retry_policy(self, endpoint, default_policy):
+        if endpoint not in self.retry_policies:
+            policy_ = default_policy
+            for key in ["default", endpoint]:
+                if key in self.retry_config and self.retry_config[key]:
+                    policy_ = policy_.with_config(self.retry_config[key])
+            self.retry_policies[endpoint] = policy_
+        return self.retry_policies[endpoint]
+
+    def request_timeout(self):
+        return getattr(_request, "timeout", None) or self.timeout
 
     def get_node(self):
         if self.node:
@@ -54,30 +143,42 @@ class SonmApi:
             raise Exception("Sonm node api not initialized")
 
     def order_create(self, order):
-        result = None
+        return self.id_result(self.order_create_rest(self.order_request(order)))
+
+    @staticmethod
+    def order_request(order):
         if len([key for key in ["duration", "price", "identity"] if key not in order]) > 0:
             raise Exception("Bid order must have all this keys: duration, price, identity")
+        # Bid of the node is left as is, request gets converted copy
+        order = dict(order)
         order["duration"] = {"nanoseconds": int(timeparse(order["duration"]) * 1e9)}
         order["price"] = {"perSecond": str(parse_price(order["price"]))}
         order["identity"] = Identity[order["identity"]].value
-        create_order = self.order_create_rest(order)
-        if create_order:
-            result = {"id": create_order["id"]}
+        return order
+
+    @staticmethod
+    def id_result(response):
+        result = None
+        if response:
+            result = {"id": response["id"]}
         return result
 
     def order_list(self, limit):
         order_list_ = self.order_list_rest(limit)
         orders_ = None
-        if order_list_ and "orders" in order_list_ is not None:
+        if order_list_:
             orders_ = [{"id": order["order"]["id"],
                         "tag": parse_tag(order["order"]["tag"]),
                         "price": order["order"]["price"]}
-                       for order in list(order_list_["orders"])]
+                       for order in list(order_list_.get("orders", []))]
         return {"orders": orders_}
 
     def order_status(self, order_id):
+        return self.order_status_result(self.order_status_rest(order_id))
+
+    @staticmethod
+    def order_status_result(order_status_):
         result = None
-        order_status_ = self.order_status_rest(order_id)
         if order_status_:
             result = {"orderStatus": order_status_["orderStatus"],
                       "tag": parse_tag(order_status_["tag"]),
@@ -85,23 +186,40 @@ class SonmApi:
         return result
 
     def order_cancel(self, order_id):
-        result = None
-        order_cancel_ = self.order_cancel_rest([order_id])
-        if order_cancel_:
-            result = {}
-        return result
+        return self.empty_result(self.order_cancel_rest([order_id]))
+
+    @staticmethod
+    def empty_result(response):
+        return {} if response else None
+
+    def order_cancel_many(self, order_ids, batch=100):
+        # Returns ids of orders which weren't cancelled
+        failed_ = []
+        for num in range(0, len(order_ids), batch):
+            chunk_ = order_ids[num:num + batch]
+            try:
+                cancelled_ = self.order_cancel_rest(chunk_)
+            except CircuitOpenError:
+                cancelled_ = None
+            if not cancelled_:
+                failed_ += chunk_
+        return failed_
 
     def deal_list(self, limit):
-        result = []
+        result = None
         deal_list_ = self.deal_list_rest(limit)
-        if deal_list_ and "deals" in deal_list_:
-            for d in [d_["deal"] for d_ in deal_list_['deals']]:
-                result.append({"id": d["id"]})
+        if deal_list_:
+            result = []
+            for d in [d_["deal"] for d_ in deal_list_.get("deals", [])]:
+                result.append({"id": d["id"], "bid_id": d.get("bidID")})
         return result
 
     def deal_status(self, deal_id):
+        return self.deal_status_result(self.deal_status_rest(deal_id))
+
+    @staticmethod
+    def deal_status_result(deal_status):
         result = None
-        deal_status = self.deal_status_rest(deal_id)
         if deal_status and "deal" in deal_status:
             deal_status_ = deal_status["deal"]
             result = {"status": deal_status_["status"],
@@ -116,26 +234,21 @@ class SonmApi:
         return result
 
     def deal_close(self, deal_id, bl_worker=False):
-        result = None
-        close_deal = self.deal_close_rest(deal_id, bl_worker)
-        if close_deal:
-            result = {}
-        return result
+        return self.empty_result(self.deal_close_rest(deal_id, bl_worker))
 
     def task_status(self, deal_id, task_id):
+        return self.task_status_result(self.task_status_rest(deal_id, task_id))
+
+    @staticmethod
+    def task_status_result(task_status_):
         result = None
-        task_status_ = self.task_status_rest(deal_id, task_id)
         if task_status_ and "status" in task_status_:
             result = {"status": task_status_["status"],
                       "uptime": str(int(float(int(task_status_["uptime"]) / 1e9)))}
         return result
 
     def task_start(self, deal_id, task, timeout):
-        result = None
-        task_start = self.task_start_rest(deal_id, task, timeout)
-        if task_start:
-            result = {"id": task_start["id"]}
-        return result
+        return self.id_result(self.task_start_rest(deal_id, task, timeout))
 
     def predict_bid(self, bid_):
         result = None
@@ -155,53 +268,126 @@ class SonmApi:
 
     @retry_on_status
     def token_balance_rest(self):
-        return self.get_node().token.balance(timeout=self.timeout)
+        return self.get_node().token.balance(timeout=self.request_timeout())
 
     @retry_on_status
     def predict_bid_rest(self, bid_):
-        return self.get_node().predictor.predict(bid_, timeout=self.timeout)
+        return self.get_node().predictor.predict(bid_, timeout=self.request_timeout())
 
     @retry_on_status
     def deal_status_rest(self, deal_id):
-        return self.get_node().deal.status(deal_id, timeout=self.timeout)
+        return self.get_node().deal.status(deal_id, timeout=self.request_timeout())
 
     @retry_on_status
     def deal_list_rest(self, limit):
         filters = {"status": 1,
                    "consumerID": self.get_node().eth_addr,
                    "limit": limit}
-        return self.get_node().deal.list(filters, timeout=self.timeout)
+        return self.get_node().deal.list(filters, timeout=self.request_timeout())
 
     @retry_on_status
     def deal_close_rest(self, deal_id, blacklist):
-        return self.get_node().deal.close(deal_id, blacklist, timeout=self.timeout)
+        return self.get_node().deal.close(deal_id, blacklist, timeout=self.request_timeout())
 
     @retry_on_status
     def order_create_rest(self, order):
-        return self.get_node().order.create(order, timeout=self.timeout)
+        return self.get_node().order.create(order, timeout=self.request_timeout())
 
     @retry_on_status
     def order_list_rest(self, limit):
-        return self.get_node().order.list(self.get_node().eth_addr, limit, timeout=self.timeout)
+        return self.get_node().order.list(self.get_node().eth_addr, limit, timeout=self.request_timeout())
 
     @retry_on_status
     def order_status_rest(self, order_id):
-        return self.get_node().order.status(order_id, timeout=self.timeout)
+        return self.get_node().order.status(order_id, timeout=self.request_timeout())
 
     @retry_on_status
-    def order_cancel_rest(self, order_id):
-        return self.get_node().order.cancel(order_id, timeout=self.timeout)
+    def order_cancel_rest(self, order_ids):
+        return self.get_node().order.cancel(order_ids, timeout=self.request_timeout())
 
-    @retry_on_status(attempts=10, sleep_time=10)
+    @retry_on_status(attempts=10, backoff=2, max_backoff=20, deadline=90)
     def task_status_rest(self, deal_id, task_id):
-        return self.get_node().task.status(deal_id, task_id, timeout=self.timeout)
+        return self.get_node().task.status(deal_id, task_id, timeout=self.request_timeout())
 
     @retry_on_status(attempts=1)
     def task_start_rest(self, deal_id, task, timeout):
         return self.get_node().task.start(deal_id, task, timeout=timeout)
 
     @staticmethod
-    def task_logs(deal_id, task_id, rownum, filename):
-        command = [get_sonmcli(), "task", "logs", deal_id, task_id, "--tail", rownum]
-        with open(filename, "w") as outfile:
-            subprocess.call(command, stdout=outfile)
+    def task_logs_chunks(deal_id, task_id, rownum, timeout, chunk_size=65536):
+        # Logs are still read from `sonmcli task logs` output: sonm_pynode has no task logs call, so sonmcli has to
+        # be on PATH. Only reading, size cap and timeout are done in process
+        command = [get_sonmcli(), "task", "logs", deal_id, task_id, "--tail", str(rownum)]
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        killer = threading.Timer(timeout, process.kill)
+        killer.start()
+        try:
+            while True:
+                chunk = process.stdout.read1(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            killer.cancel()
+            if process.poll() is None:
+                process.kill()
+            process.stdout.close()
+            process.wait()
+
+    @staticmethod
+    def task_logs(deal_id, task_id, rownum, filename, compress=False, max_bytes=0, timeout=300):
+        # Logs are written chunk by chunk as they arrive, download stops on byte cap or timeout
+        started = time.time()
+        written = 0
+        if compress:
+            filename, outfile = filename + ".gz", gzip.open(filename + ".gz", "wb")
+        else:
+            outfile = open(filename, "wb")
+        with outfile:
+            for chunk in SonmApi.task_logs_chunks(deal_id, task_id, rownum, timeout):
+                if max_bytes and written + len(chunk) >= max_bytes:
+                    outfile.write(chunk[:max_bytes - written])
+                    written = max_bytes
+                    logger.info("Task logs {} truncated at {} bytes".format(filename, max_bytes))
+                    break
+                outfile.write(chunk)
+                written += len(chunk)
+        logger.info("Saved {} bytes of task logs to {} in {:.1f} sec".format(written, filename, time.time() - started))
+        return written
+
+
+class AsyncSonmApi:
+    # Api of node coroutines. Requests run in executor, waits between retries are done on event loop,
+    # so nodes which retry don't hold executor threads
+    def __init__(self, sonm_api: SonmApi, executor=None, logs_executor=None):
+        self.sonm_api = sonm_api
+        self.executor = executor
+        self.logs_executor = logs_executor
+
+    def call(self, method, *args):
+        return getattr(SonmApi, method).run_async(self.sonm_api, self.executor, *args)
+
+    async def order_create(self, order):
+        return SonmApi.id_result(await self.call("order_create_rest", SonmApi.order_request(order)))
+
+    async def order_status(self, order_id):
+        return SonmApi.order_status_result(await self.call("order_status_rest", order_id))
+
+    async def order_cancel(self, order_id):
+        return SonmApi.empty_result(await self.call("order_cancel_rest", [order_id]))
+
+    async def deal_status(self, deal_id):
+        return SonmApi.deal_status_result(await self.call("deal_status_rest", deal_id))
+
+    async def deal_close(self, deal_id, bl_worker=False):
+        return SonmApi.empty_result(await self.call("deal_close_rest", deal_id, bl_worker))
+
+    async def task_status(self, deal_id, task_id):
+        return SonmApi.task_status_result(await self.call("task_status_rest", deal_id, task_id))
+
+    async def task_start(self, deal_id, task, timeout):
+        return SonmApi.id_result(await self.call("task_start_rest", deal_id, task, timeout))
+
+    async def task_logs(self, *args, **kwargs):
+        return await asyncio.get_event_loop().run_in_executor(self.logs_executor,
+                                                              partial(SonmApi.task_logs, *args, **kwargs))
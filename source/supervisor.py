@@ -0,0 +1,90 @@
+import logging
+import threading
+
+from source.config import Config
+from source.drain import drain_nodes
+from source.journal import Journal
+from source.utils import Nodes
+from source.worknode import State
+
+logger = logging.getLogger("monitor")
+
+
+class Supervisor(object):
+    def __init__(self, engine, restart_delay=10):
+        self.engine = engine
+        self.restart_delay = restart_delay
+        self.lock = threading.Lock()
+        self.scheduled = {}
+        self.idle = threading.Event()
+
+    def schedule(self, node, delay=0):
+        # Scheduled nodes are the single source of truth, node is never submitted twice
+        with self.lock:
+            if node.node_tag in self.scheduled:
+                return
+            logger.info("Adding Node {} to executor".format(node.node_tag))
+            future = self.engine.submit(node, delay)
+            self.scheduled[node.node_tag] = future
+            self.idle.clear()
+        future.add_done_callback(lambda f: self.on_done(node, f))
+
+    def schedule_all(self):
+        # Orders are placed in batches before, so nodes don't need to be staggered
+        nodes_ = Nodes.get_nodes_arr()
+        if len(nodes_) == 0:
+            self.idle.set()
+        for node in nodes_:
+            self.schedule(node)
+
+    def on_done(self, node, future):
+        logger.info("Removing Node {} from execution list.".format(node.node_tag))
+        exception_ = None if future.cancelled() else future.exception()
+        if exception_:
+            logger.error("Node {} failed with exception".format(node.node_tag), exc_info=exception_)
+            node.RUNNING = False
+        with self.lock:
+            if self.scheduled.get(node.node_tag) is future:
+                del self.scheduled[node.node_tag]
+        if exception_ and node.KEEP_WORK and node.node_tag in Config.node_configs:
+            self.schedule(node, self.restart_delay)
+        with self.lock:
+            if len(self.scheduled) == 0:
+                self.idle.set()
+
+    def on_config_change(self, diff):
+        removed_ = [node_tag for node_tag in diff.removed if Nodes.has_node(node_tag)]
+        if removed_:
+            # Drain may take minutes, it runs on its own thread, not on node api workers
+            threading.Thread(target=self.remove_nodes, args=(removed_,), name="remove-nodes", daemon=True).start()
+        for node_tag in diff.added:
+            if Nodes.has_node(node_tag):
+                self.schedule(Nodes.get_node(node_tag))
+
+    def drain(self, node_tags):
+        nodes_ = [Nodes.get_node(node_tag) for node_tag in node_tags if Nodes.has_node(node_tag)]
+        with self.lock:
+            futures_ = [self.scheduled[node.node_tag] for node in nodes_ if node.node_tag in self.scheduled]
+        drain_nodes(self.engine.sonm_api, nodes_, futures_)
+
+    def drain_tag(self, tag):
+        logger.info("Draining tag {}".format(tag))
+        self.drain([node.node_tag for node in Nodes.get_tag_nodes(tag)])
+
+    def remove_nodes(self, node_tags):
+        # Destroy nodes, if they aren't exist in reloaded config
+        logger.info("Stopping Nodes {}. They don't exist in configuration".format(", ".join(node_tags)))
+        self.drain(node_tags)
+        for node_tag in node_tags:
+            node_ = Nodes.get_node(node_tag)
+            if node_.status not in [State.WORK_COMPLETED, State.START, State.CREATE_ORDER]:
+                # Drain didn't finish this node before deadline, it is purged one by one
+                node_.finish_work()
+            logger.info("Removing Node {} from active nodes list.".format(node_tag))
+            Nodes.remove_node(node_tag)
+            Journal.remove(node_tag)
+
+    def wait(self):
+        # Short timeout keeps main thread responsive to KeyboardInterrupt
+        while not self.idle.wait(1):
+            pass
@@ -0,0 +1,111 @@
+import logging
+import sys
+import threading
+import time
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger("monitor")
+
+
+class PooledAdapter(HTTPAdapter):
+    def __init__(self, pool_size=10, per_host=20):
+        self.per_host = per_host
+        self.host_slots = {}
+        self.stats_lock = threading.Lock()
+        self.stats = {"requests": 0, "waits": 0, "wait_time": 0.0}
+        super().__init__(pool_connections=pool_size, pool_maxsize=per_host, pool_block=True)
+
+    def host_slot(self, host):
+        with self.stats_lock:
+            if host not in self.host_slots:
+                self.host_slots[host] = threading.BoundedSemaphore(self.per_host)
+            return self.host_slots[host]
+
+    def send(self, request, **kwargs):
+        slot = self.host_slot(urlparse(request.url).netloc)
+        waited = 0.0
+        if not slot.acquire(blocking=False):
+            start = time.time()
+            slot.acquire()
+            waited = time.time() - start
+        with self.stats_lock:
+            self.stats["requests"] += 1
+            if waited:
+                self.stats["waits"] += 1
+                self.stats["wait_time"] += waited
+        try:
+            return super().send(request, **kwargs)
+        finally:
+            slot.release()
+
+    def connections(self):
+        pools = self.poolmanager.pools
+        with pools.lock:
+            pools_ = list(pools._container.values())
+        return sum(pool.num_connections for pool in pools_)
+
+
+class SessionRequests(object):
+    # Stands in for the requests module inside sonm_pynode, so its module-level calls reuse our session
+    def __init__(self, session):
+        self.session = session
+
+    def request(self, method, url, **kwargs):
+        return self.session.request(method, url, **kwargs)
+
+    def get(self, url, **kwargs):
+        return self.session.get(url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.session.post(url, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(requests, name)
+
+
+class PooledTransport(object):
+    # Client modules are patched once per process, later transports take over the patched requests.
+    # Shard processes inherit patched modules, their own transport replaces the session of coordinator
+    patched = {}
+    lock = threading.Lock()
+
+    def __init__(self, pool_size=10, per_host=20):
+        self.adapter = PooledAdapter(pool_size, per_host)
+        self.session = requests.Session()
+        self.session.mount("http://", self.adapter)
+        self.session.mount("https://", self.adapter)
+
+    def install(self, node):
+        if isinstance(getattr(node, "session", None), requests.Session):
+            node.session = self.session
+            return
+        package_ = type(node).__module__.split(".")[0]
+        with PooledTransport.lock:
+            if package_ in PooledTransport.patched:
+                PooledTransport.patched[package_].session = self.session
+                return
+            modules_ = [module_ for name, module_ in list(sys.modules.items())
+                        if (name == package_ or name.startswith(package_ + "."))
+                        and getattr(module_, "requests", None) is requests]
+            if not modules_:
+                logger.warning("Node api client {} doesn't use requests module, connection pool isn't used"
+                               .format(package_))
+                return
+            requests_ = SessionRequests(self.session)
+            for module_ in modules_:
+                module_.requests = requests_
+            PooledTransport.patched[package_] = requests_
+
+    def metrics(self):
+        with self.adapter.stats_lock:
+            stats = dict(self.adapter.stats)
+        stats["connections"] = self.adapter.connections()
+        stats["pool_hits"] = max(stats["requests"] - stats["connections"], 0)
+        return stats
+
+    def log_metrics(self):
+        logger.info("Node api connections: {connections} opened, {requests} requests, {pool_hits} reused, "
+                    "{waits} waited for free connection ({wait_time:.2f} sec)".format(**self.metrics()))
@@ -1,18 +1,22 @@
 import base64
+import bisect
 import errno
 import logging
 import os
 import platform
 import re
+import threading
+import zlib
 from enum import Enum
 
-import ruamel.yaml
 from jinja2 import Template
 
 from ruamel import yaml
+from ruamel.yaml import YAML
 from tabulate import tabulate
 
 logger = logging.getLogger("monitor")
+templates_ = {}
 
 
 class Identity(Enum):
@@ -32,20 +36,97 @@ class TaskStatus(Enum):
     broken = 5
 
 
+class NodeList(object):
+    # Nodes in natural order of node tags. Lists are replaced on change (copy-on-write),
+    # so readers get them without sorting or locking
+    def __init__(self):
+        self.keys = []
+        self.nodes = []
+
+    def add(self, node, key_):
+        index_ = bisect.bisect(self.keys, key_)
+        self.keys = self.keys[:index_] + [key_] + self.keys[index_:]
+        self.nodes = self.nodes[:index_] + [node] + self.nodes[index_:]
+
+    def remove(self, node, key_):
+        index_ = bisect.bisect_left(self.keys, key_)
+        self.keys = self.keys[:index_] + self.keys[index_ + 1:]
+        self.nodes = self.nodes[:index_] + self.nodes[index_ + 1:]
+
+
 class Nodes(object):
+    # Registry is changed by node and config threads and read by dashboard, metrics and supervisor
+    lock = threading.RLock()
     nodes_ = dict()
+    all_ = NodeList()
+    by_tag = dict()
+    state_counts = dict()
+    version = 0
+
+    @staticmethod
+    def touch():
+        Nodes.version += 1
 
     @staticmethod
     def add_node(node):
-        Nodes.nodes_[node.node_tag] = node
+        with Nodes.lock:
+            if node.node_tag in Nodes.nodes_:
+                Nodes.remove_node(node.node_tag)
+            key_ = natural_keys(node.node_tag)
+            Nodes.nodes_[node.node_tag] = node
+            Nodes.all_.add(node, key_)
+            Nodes.by_tag.setdefault(node.tag, NodeList()).add(node, key_)
+            Nodes.count_state(node.tag, node.status, 1)
+            Nodes.touch()
+
+    @staticmethod
+    def clear():
+        # Restarted shard process is forked from coordinator with its remote nodes. Lock isn't taken:
+        # it may be held by coordinator thread which doesn't exist in the new process
+        Nodes.lock = threading.RLock()
+        Nodes.nodes_ = dict()
+        Nodes.all_ = NodeList()
+        Nodes.by_tag = dict()
+        Nodes.state_counts = dict()
+        Nodes.touch()
 
     @staticmethod
     def get_node(node_tag):
         return Nodes.nodes_[node_tag]
 
+    @staticmethod
+    def has_node(node_tag):
+        return node_tag in Nodes.nodes_
+
     @staticmethod
     def remove_node(node_tag):
-        del Nodes.nodes_[node_tag]
+        with Nodes.lock:
+            node = Nodes.nodes_.pop(node_tag)
+            key_ = natural_keys(node_tag)
+            Nodes.all_.remove(node, key_)
+            Nodes.by_tag[node.tag].remove(node, key_)
+            if not Nodes.by_tag[node.tag].nodes:
+                del Nodes.by_tag[node.tag]
+            Nodes.count_state(node.tag, node.status, -1)
+            Nodes.touch()
+
+    @staticmethod
+    def on_status(node, previous_):
+        # Called by nodes on every status change, nodes which aren't registered yet are counted by add_node
+        with Nodes.lock:
+            if Nodes.nodes_.get(node.node_tag) is not node:
+                return
+            if previous_ is not None:
+                Nodes.count_state(node.tag, previous_, -1)
+            Nodes.count_state(node.tag, node.status, 1)
+            Nodes.touch()
+
+    @staticmethod
+    def count_state(tag, status, delta):
+        key_ = (tag, status)
+        Nodes.state_counts[key_] = Nodes.state_counts.get(key_, 0) + delta
+        if Nodes.state_counts[key_] == 0:
+            del Nodes.state_counts[key_]
 
     @staticmethod
     def get_nodes_keys():
@@ -53,9 +134,22 @@ class Nodes(object):
 
     @staticmethod
     def get_nodes_arr():
-        temp = list(Nodes.nodes_.values())
-        temp.sort(key=lambda x: natural_keys(x.node_tag))
-        return temp
+        return Nodes.all_.nodes
+
+    @staticmethod
+    def get_tags():
+        with Nodes.lock:
+            return sorted(Nodes.by_tag.keys(), key=natural_keys)
+
+    @staticmethod
+    def get_tag_nodes(tag):
+        list_ = Nodes.by_tag.get(tag)
+        return list_.nodes if list_ else []
+
+    @staticmethod
+    def get_state_counts():
+        with Nodes.lock:
+            return dict(Nodes.state_counts)
 
 
 def atoi(text):
@@ -66,6 +160,11 @@ def natural_keys(text):
     return [atoi(c) for c in re.split("(\d+)", text)]
 
 
+def shard_of(node_tag, shards):
+    # Stable across processes and restarts, unlike hash() of str
+    return zlib.crc32(node_tag.encode()) % shards
+
+
 def parse_tag(order_):
     return base64.b64decode(order_).decode().strip("\0")
 
@@ -108,13 +207,38 @@ def validate_eth_addr(eth_addr):
         return None
 
 
+class StateDump(object):
+    rows = {}
+    version = None
+
+
 def print_state():
-    tabul_nodes = [[n.node_tag, n.bid_id, n.price, n.deal_id, n.task_id, n.task_uptime, n.status.name] for n in
-                   Nodes.get_nodes_arr()]
-    logger.info("Nodes:\n" +
-                tabulate(tabul_nodes,
-                         ["Node", "Order id", "Order price", "Deal id", "Task id", "Task uptime", "Node status"],
-                         tablefmt="grid"))
+    # Only nodes changed since previous dump are listed, task uptime alone isn't a change
+    counts_ = {}
+    for (tag, status), count in Nodes.get_state_counts().items():
+        counts_[status.name] = counts_.get(status.name, 0) + count
+    summary_ = "Nodes: {} total{}".format(sum(counts_.values()), "".join(
+        ", {} {}".format(name, count) for name, count in sorted(counts_.items())))
+    if StateDump.version == Nodes.version:
+        logger.info(summary_ + ". No changes")
+        return
+    StateDump.version = Nodes.version
+    nodes_ = Nodes.get_nodes_arr()
+    rows_ = {n.node_tag: (n.bid_id, n.price, n.deal_id, n.task_id, n.status.name) for n in nodes_}
+    changed_ = [[n.node_tag, n.bid_id, n.price, n.deal_id, n.task_id, n.task_uptime, n.status.name] for n in nodes_
+                if StateDump.rows.get(n.node_tag) != rows_[n.node_tag]]
+    removed_ = [node_tag for node_tag in StateDump.rows if node_tag not in rows_]
+    StateDump.rows = rows_
+    if not changed_ and not removed_:
+        logger.info(summary_ + ". No changes")
+        return
+    message_ = summary_
+    if changed_:
+        message_ += "\nChanged nodes:\n" + tabulate(changed_, ["Node", "Order id", "Order price", "Deal id", "Task id",
+                                                               "Task uptime", "Node status"], tablefmt="grid")
+    if removed_:
+        message_ += "\nRemoved nodes: {}".format(", ".join(removed_))
+    logger.info(message_)
 
 
 def template_bid(config, tag="", counterparty=None):
@@ -159,10 +283,20 @@ def dump_file(data, filename):
         yaml.dump(data, file, Dumper=yaml.RoundTripDumper)
 
 
+def get_template(file_):
+    # Compiled templates are reused until template file is modified
+    mtime_ = os.stat(file_).st_mtime
+    cached_ = templates_.get(file_)
+    if cached_ and cached_[0] == mtime_:
+        return cached_[1]
+    with open(file_, 'r') as fp:
+        t = Template(fp.read())
+    templates_[file_] = (mtime_, t)
+    return t
+
+
 def template_task(file_, kwargs=None):
     if not kwargs:
         kwargs = {}
-    with open(file_, 'r') as fp:
-        t = Template(fp.read())
-        data = t.render(**kwargs)
-        return ruamel.yaml.round_trip_load(data, preserve_quotes=True)
+    data = get_template(file_).render(**kwargs)
+    return YAML(typ='safe').load(data)
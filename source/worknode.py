@@ -1,12 +1,20 @@
+import asyncio
 import logging
+import threading
 import time
 from enum import Enum
 from os.path import join
 
-import yaml
-
+from source.breaker import CircuitOpenError
 from source.config import Config
-from source.utils import template_bid, template_task, convert_price, TaskStatus, dump_file
+from source.journal import Journal
+from source.polling import Polling, PollWheel
+from source.reconciler import Reconciler
+from source.retry import interruptible
+from source.sonmapi import AsyncSonmApi
+from source.utils import template_bid, template_task, convert_price, TaskStatus, dump_file, Nodes
+
+logger = logging.getLogger("monitor")
 
 
 class State(Enum):
@@ -29,28 +37,80 @@ def restart_timeout():
     return Config.base_config["restart_timeout"] if "restart_timeout" in Config.base_config else 600
 
 
+def save_task_files():
+    return Config.base_config["save_task_files"] if "save_task_files" in Config.base_config else False
+
+
+def task_logs_config():
+    return Config.base_config["task_logs"] if "task_logs" in Config.base_config else {}
+
+
 class WorkNode:
+    # Thousands of nodes live in one process: no per-node dict, specs are shared per tag or built on demand
+    __slots__ = ("journaled", "RUNNING", "KEEP_WORK", "stop_event", "status_changed", "loop", "wakeup", "node_tag",
+                 "tag", "config", "_status", "state_since", "sonm_api", "api", "deal_id", "task_id", "bid_id",
+                 "price_usd", "task_uptime", "last_heartbeat", "api_checked", "logs_saved")
+
     def __init__(self, status, sonm_api, node_tag, deal_id, task_id, bid_id, price):
+        self.journaled = False
         self.RUNNING = False
         self.KEEP_WORK = True
-        self.logger = logging.getLogger("monitor")
+        self.stop_event = threading.Event()
+        self.status_changed = threading.Condition()
+        self.loop = None
+        self.wakeup = None
         self.node_tag = node_tag
         self.tag = self.node_tag.split('_')[0]
-        self.node_num = self.node_tag.split('_')[1]
         self.config = Config.get_node_config(self.node_tag)
         self.status = status
         self.sonm_api = sonm_api
-        self.bid_file = "out/orders/{}.yaml".format(self.node_tag)
-        self.task_file = "out/tasks/{}.yaml".format(self.node_tag)
-        self.bid_ = {}
-        self.task_ = {}
+        self.api = None
         self.deal_id = deal_id
         self.task_id = task_id
         self.bid_id = bid_id
-        self.price = "{0:.4f} USD/h".format(convert_price(price)) if price != "" else ""
+        self.price_usd = convert_price(price) if price != "" else None
         self.task_uptime = 0
-        self.create_task_yaml()
         self.last_heartbeat = time.time()
+        self.api_checked = time.time()
+        self.logs_saved = ""
+        self.journaled = True
+        Journal.record(self)
+
+    @property
+    def status(self):
+        return self._status
+
+    @status.setter
+    def status(self, status):
+        with self.status_changed:
+            previous_ = getattr(self, "_status", None)
+            self._status = status
+            if previous_ != status:
+                self.state_since = time.time()
+            Nodes.on_status(self, previous_)
+            self.status_changed.notify_all()
+        if self.journaled:
+            Journal.record(self)
+
+    @property
+    def node_num(self):
+        return self.node_tag.split('_')[1]
+
+    @property
+    def price(self):
+        return "{0:.4f} USD/h".format(self.price_usd) if self.price_usd is not None else ""
+
+    def poll_interval(self, kind):
+        age = time.time() - self.state_since
+        if kind == "running":
+            age = max(age, int(self.task_uptime or 0))
+        return min(Polling.interval(kind, age), restart_timeout() / 2)
+
+    def api_check_due(self):
+        if time.time() - self.api_checked < Polling.api_interval():
+            return False
+        self.api_checked = time.time()
+        return True
 
     @classmethod
     def create_empty(cls, sonm_api, node_tag):
@@ -61,29 +121,39 @@ class WorkNode:
         return self.RUNNING
 
     def reload_config(self):
-        Config.reload_node_config(self.node_tag)
-        self.config = Config.get_node_config(self.node_tag)
+        # Node configs are kept up to date by the reload_config job, node is left with its last config if removed
+        config_ = Config.get_node_config(self.node_tag)
+        if config_:
+            self.config = config_
 
     def create_task_yaml(self):
-        self.logger.info("Creating task file for Node {}".format(self.node_tag))
+        # Task spec is rendered right before task start, it isn't kept by node
+        logger.info("Creating task spec for Node {}".format(self.node_tag))
         file_ = join(Config.config_folder, self.config["template_file"])
         kwargs = {'node_tag': self.node_tag, 'node_num': self.node_num}
-        data = template_task(file_, kwargs)
-        dump_file(data, self.task_file)
-        with open(self.task_file) as f:
-            self.task_ = yaml.safe_load(f)
+        task_ = template_task(file_, kwargs)
+        if save_task_files():
+            dump_file(task_, "out/tasks/{}.yaml".format(self.node_tag))
+        return task_
 
     def create_bid_yaml(self):
-        self.logger.info("Creating order file for Node {}".format(self.node_tag))
-        self.bid_ = template_bid(self.config, self.node_tag, self.config["counterparty"])
-
+        logger.info("Creating order file for Node {}".format(self.node_tag))
         price_, predicted_, predicted_w_coeff_ = self.get_price()
-        self.price = self.format_price(price_, readable=True)
-        self.bid_["price"] = self.format_price(price_)
-
-        self.logger.info("Predicted price for Node {} is {:.4f} USD/h, with coefficient {:.4f} USD/h, order price is {}"
-                         .format(self.node_tag, predicted_, predicted_w_coeff_, self.price))
-        dump_file(self.bid_, self.bid_file)
+        bid_ = self.create_bid(price_)
+        logger.info("Predicted price for Node {} is {:.4f} USD/h, with coefficient {:.4f} USD/h, order price is {}"
+                    .format(self.node_tag, predicted_, predicted_w_coeff_, self.price))
+        dump_file(bid_, "out/orders/{}.yaml".format(self.node_tag))
+        return bid_
+
+    def create_bid(self, price_):
+        # Resources part of bid is shared by all nodes of the tag
+        bid_ = dict(Config.bids[self.tag]) if self.tag in Config.bids else template_bid(self.config)
+        bid_["tag"] = self.node_tag
+        if self.config["counterparty"]:
+            bid_["counterparty"] = self.config["counterparty"]
+        self.price_usd = float(price_)
+        bid_["price"] = self.format_price(price_)
+        return bid_
 
     def get_price(self):
         predicted_price = Config.price_for_tag(self.tag)
@@ -97,208 +167,344 @@ class WorkNode:
                 price_ = predicted_w_coeff_
         return price_, predicted_, predicted_w_coeff_
 
-    def create_order(self):
+    async def create_order(self):
         self.reload_config()
-        self.create_bid_yaml()
-        self.status = State.PLACING_ORDER
-        self.logger.info("Create order for Node {}".format(self.node_tag))
-        create_order = self.sonm_api.order_create(self.bid_)
+        await self.place_order_async(self.create_bid_yaml())
+
+    def place_order(self, bid_):
+        # Used by batch placement threads, node coroutine uses place_order_async
+        if not self.start_placing():
+            return False
+        try:
+            create_order = self.sonm_api.order_create(bid_)
+        except Exception:
+            self.status = State.CREATE_ORDER
+            raise
+        self.order_placed(create_order)
+        return True
+
+    async def place_order_async(self, bid_):
+        if not self.start_placing():
+            return False
+        try:
+            create_order = await self.api.order_create(bid_)
+        except Exception:
+            self.status = State.CREATE_ORDER
+            raise
+        self.order_placed(create_order)
+        return True
+
+    def start_placing(self):
+        # Checked and set under status lock: deal adopted by journal verification thread wins over new order
+        with self.status_changed:
+            if self.status not in [State.START, State.CREATE_ORDER]:
+                return False
+            self.status = State.PLACING_ORDER
+        logger.info("Create order for Node {}".format(self.node_tag))
+        return True
+
+    def order_placed(self, create_order):
         if not create_order:
+            self.status = State.CREATE_ORDER
             raise Exception("Cannot create order. Check sonm-node status or your balance")
         self.bid_id = create_order["id"]
+        self.api_checked = time.time()
         self.status = State.AWAITING_DEAL
-        self.logger.info("Order for Node {} is {}".format(self.node_tag, self.bid_id))
+        logger.info("Order for Node {} is {}".format(self.node_tag, self.bid_id))
 
-    def check_order(self):
-        order_status = self.sonm_api.order_status(self.bid_id)
-        self.logger.info("Checking order {} (Node {}) for new deal".format(self.bid_id, self.node_tag))
+    async def check_order(self):
+        order_status = Reconciler.order_status(self.bid_id)
+        if order_status is None and self.api_check_due():
+            order_status = await self.api.order_status(self.bid_id)
+        logger.info("Checking order {} (Node {}) for new deal".format(self.bid_id, self.node_tag))
         if order_status and order_status["orderStatus"] == 1 and order_status["dealID"] != "0":
             self.deal_id = order_status["dealID"]
+            self.api_checked = time.time()
             self.status = State.DEAL_OPENED
-            self.logger.info("For order {} (Node {}) opened new deal {}"
-                             .format(self.bid_id, self.node_tag, self.deal_id))
+            logger.info("For order {} (Node {}) opened new deal {}"
+                        .format(self.bid_id, self.node_tag, self.deal_id))
             return 15
         elif order_status and order_status["orderStatus"] == 1 and order_status["dealID"] == "0":
-            self.logger.info("Order {} was cancelled (Node {}), create new order".format(self.bid_id, self.node_tag))
+            logger.info("Order {} was cancelled (Node {}), create new order".format(self.bid_id, self.node_tag))
             self.bid_id = ""
             self.status = State.CREATE_ORDER
             return 1
-        return 60
+        return self.poll_interval("awaiting_deal")
 
-    def cancel_order(self):
-        self.sonm_api.order_cancel(self.bid_id)
+    async def cancel_order(self):
+        await self.api.order_cancel(self.bid_id)
 
-    def start_task(self):
+    async def start_task(self):
         # Start task on node
         self.status = State.STARTING_TASK
-        self.logger.info("Starting task on node {} ...".format(self.node_tag))
-        task = self.sonm_api.task_start(self.deal_id, self.task_, self.config["task_start_timeout"])
+        logger.info("Starting task on node {} ...".format(self.node_tag))
+        try:
+            task = await self.api.task_start(self.deal_id, self.create_task_yaml(), self.config["task_start_timeout"])
+        except CircuitOpenError:
+            self.status = State.DEAL_OPENED
+            raise
         if not task:
-            self.logger.error("Failed to start task (Node {}) on deal {}. Closing deal and blacklisting counterparty "
-                              "worker's address...".format(self.node_tag, self.deal_id))
+            logger.error("Failed to start task (Node {}) on deal {}. Closing deal and blacklisting counterparty "
+                         "worker's address...".format(self.node_tag, self.deal_id))
             self.status = State.TASK_FAILED_TO_START
         else:
-            self.logger.info("Task (Node {}) started: deal {} with task_id {}"
-                             .format(self.node_tag, self.deal_id, task["id"]))
+            logger.info("Task (Node {}) started: deal {} with task_id {}"
+                        .format(self.node_tag, self.deal_id, task["id"]))
             self.task_id = task["id"]
             self.status = State.TASK_RUNNING
 
-    def close_deal(self, state_after, blacklist=False):
+    async def close_deal(self, state_after, blacklist=False):
         # Close deal on node
-        self.logger.info("Saving logs deal_id {} task_id {}".format(self.deal_id, self.task_id))
-        if self.status == State.TASK_FAILED or self.status == State.TASK_BROKEN:
-            self.save_task_logs("out/fail_")
-        if self.status == State.TASK_FINISHED:
-            self.save_task_logs("out/success_")
-        self.logger.info("Closing deal {} on Node {} {}..."
-                         .format(self.deal_id, self.node_tag, ("with blacklisting worker" if blacklist else " ")))
-        deal_status = self.sonm_api.deal_status(self.deal_id)
+        if self.logs_saved != self.deal_id:
+            # Node is parked while node api is down, logs are downloaded on the next try instead of an empty file
+            if self.sonm_api.breaker.is_open():
+                raise CircuitOpenError(self.sonm_api.breaker.retry_in())
+            logger.info("Saving logs deal_id {} task_id {}".format(self.deal_id, self.task_id))
+            # Logs are gone with the deal, node waits for download without holding an api worker
+            if self.status == State.TASK_FAILED or self.status == State.TASK_BROKEN:
+                await self.save_task_logs_async("out/fail_")
+            if self.status == State.TASK_FINISHED:
+                await self.save_task_logs_async("out/success_")
+            self.logs_saved = self.deal_id
+        logger.info("Closing deal {} on Node {} {}..."
+                    .format(self.deal_id, self.node_tag, ("with blacklisting worker" if blacklist else " ")))
+        deal_status = await self.api.deal_status(self.deal_id)
         if deal_status and deal_status["status"] == 2:
-            self.logger.error("Deal {} (Node {}) already closed".format(self.deal_id, self.node_tag))
+            logger.error("Deal {} (Node {}) already closed".format(self.deal_id, self.node_tag))
         else:
-            self.sonm_api.deal_close(self.deal_id, blacklist)
-            self.logger.info("Deal {} was closed".format(self.deal_id))
+            await self.api.deal_close(self.deal_id, blacklist)
+            logger.info("Deal {} was closed".format(self.deal_id))
         self.deal_id = ""
         self.bid_id = ""
         self.task_uptime = 0
         self.task_id = ""
         self.status = state_after
 
-    def check_task_status(self):
-        deal_status = self.sonm_api.deal_status(self.deal_id)
+    def drain_deal(self, save_logs=False):
+        # Deal is closed right away, without status check, logs are fetched only if asked
+        if save_logs and self.task_id:
+            self.save_task_logs("out/drain_")
+        if self.sonm_api.deal_close(self.deal_id) is None:
+            logger.error("Cannot close deal {} (Node {})".format(self.deal_id, self.node_tag))
+            return False
+        logger.info("Deal {} (Node {}) was closed by drain".format(self.deal_id, self.node_tag))
+        self.deal_id = ""
+        self.bid_id = ""
+        self.task_uptime = 0
+        self.task_id = ""
+        self.status = State.WORK_COMPLETED
+        return True
+
+    async def check_starting_task(self):
+        # Task is spooling, or bot was stopped while task was starting
+        if not self.task_id:
+            logger.error("Task on deal {} (Node {}) was not started, closing deal".format(self.deal_id, self.node_tag))
+            self.status = State.TASK_FAILED
+            return 1
+        return await self.check_task_status()
+
+    async def check_task_status(self):
+        deal_status = Reconciler.deal_status(self.deal_id)
+        if deal_status is None and self.api_check_due():
+            deal_status = await self.api.deal_status(self.deal_id)
         if deal_status and deal_status["status"] == 2:
-            self.logger.info("Deal {} was closed".format(self.deal_id))
-            self.status = State.DEAL_DISAPPEARED
+            logger.info("Deal {} was closed".format(self.deal_id))
             self.deal_id = ""
             self.bid_id = ""
             self.task_uptime = 0
             self.task_id = ""
+            self.status = State.DEAL_DISAPPEARED
             return 1
         elif deal_status and "error" in deal_status:
-            self.logger.error("Cannot retrieve status deal {}".format(self.deal_id))
+            logger.error("Cannot retrieve status deal {}".format(self.deal_id))
             return 60
 
-        task_status = self.sonm_api.task_status(self.deal_id, self.task_id)
+        task_status = await self.api.task_status(self.deal_id, self.task_id)
         if not task_status:
-            self.logger.error("Cannot retrieve task status of deal {},"
-                              " task_id {} worker is offline?".format(self.deal_id, self.task_id))
+            logger.error("Cannot retrieve task status of deal {},"
+                         " task_id {} worker is offline?".format(self.deal_id, self.task_id))
             self.status = State.TASK_FAILED
             return 1
         time_ = task_status["uptime"]
         if task_status["status"] == TaskStatus.running.value:
-            self.logger.info("Task {} on deal {} (Node {}) is running. Uptime is {} seconds"
-                             .format(self.task_id, self.deal_id, self.node_tag, time_))
+            logger.info("Task {} on deal {} (Node {}) is running. Uptime is {} seconds"
+                        .format(self.task_id, self.deal_id, self.node_tag, time_))
             self.task_uptime = time_
-            return 60
-        if task_status["status"] == TaskStatus.spooling.value:
-            self.logger.info("Task {} on deal {} (Node {}) is uploading..."
-                             .format(self.task_id, self.deal_id, self.node_tag))
+            if self.status != State.TASK_RUNNING:
+                self.status = State.TASK_RUNNING
+            return self.poll_interval("running")
+        if task_status["status"] in [TaskStatus.spooling.value, TaskStatus.spawning.value]:
+            logger.info("Task {} on deal {} (Node {}) is uploading..."
+                        .format(self.task_id, self.deal_id, self.node_tag))
             self.status = State.STARTING_TASK
-            return 60
+            return self.poll_interval("spooling")
         if task_status["status"] == TaskStatus.broken.value:
             if int(time_) < self.config["ets"]:
-                self.logger.error("Task has failed ({} seconds) on deal {} (Node {}) before ETS."
-                                  " Closing deal and blacklisting counterparty worker's address..."
-                                  .format(time_, self.deal_id, self.node_tag))
+                logger.error("Task has failed ({} seconds) on deal {} (Node {}) before ETS."
+                             " Closing deal and blacklisting counterparty worker's address..."
+                             .format(time_, self.deal_id, self.node_tag))
                 self.status = State.TASK_FAILED_TO_START
                 return 1
             else:
-                self.logger.error("Task has failed ({} seconds) on deal {} (Node {}) after ETS."
-                                  " Closing deal and recreate order..."
-                                  .format(time_, self.deal_id, self.node_tag))
+                logger.error("Task has failed ({} seconds) on deal {} (Node {}) after ETS."
+                             " Closing deal and recreate order..."
+                             .format(time_, self.deal_id, self.node_tag))
                 self.status = State.TASK_BROKEN
                 return 1
         if task_status["status"] == TaskStatus.finished.value:
-            self.logger.info("Task {}  on deal {} (Node {} ) is finished. Uptime is {}  seconds"
-                             .format(self.task_id, self.deal_id, self.node_tag, time_))
-            self.logger.info("Task {}  on deal {} (Node {} ) success. Fetching log, shutting down node..."
-                             .format(self.task_id, self.deal_id, self.node_tag))
+            logger.info("Task {}  on deal {} (Node {} ) is finished. Uptime is {}  seconds"
+                        .format(self.task_id, self.deal_id, self.node_tag, time_))
+            logger.info("Task {}  on deal {} (Node {} ) success. Fetching log, shutting down node..."
+                        .format(self.task_id, self.deal_id, self.node_tag))
             self.status = State.TASK_FINISHED
             return 1
         return 60
 
-    def watch_node(self):
-        self.RUNNING = True
+    async def step(self):
+        # Steps blocked by node api outage don't mean that task is stuck, nodes aren't reset while api is down
+        if int(time.time() - self.last_heartbeat) > restart_timeout() and not self.sonm_api.breaker.is_open():
+            await self.reset_to_start()
         sleep_time = 1
+        if self.status == State.START or self.status == State.CREATE_ORDER:
+            await self.create_order()
+            sleep_time = self.poll_interval("awaiting_deal")
+        elif self.status == State.AWAITING_DEAL:
+            sleep_time = await self.check_order()
+        elif self.status == State.DEAL_OPENED:
+            await self.start_task()
+            sleep_time = self.poll_interval("running") if self.status == State.TASK_RUNNING else 1
+        elif self.status == State.STARTING_TASK:
+            sleep_time = await self.check_starting_task()
+        elif self.status == State.DEAL_DISAPPEARED:
+            self.status = State.CREATE_ORDER
+            sleep_time = 1
+        elif self.status == State.TASK_RUNNING:
+            sleep_time = await self.check_task_status()
+        elif self.status == State.TASK_FAILED_TO_START:
+            await self.close_deal(State.CREATE_ORDER, blacklist=True)
+            sleep_time = 1
+        elif self.status == State.TASK_FAILED:
+            await self.close_deal(State.CREATE_ORDER)
+            sleep_time = 1
+        elif self.status == State.TASK_BROKEN:
+            await self.close_deal(State.CREATE_ORDER)
+            sleep_time = 1
+        elif self.status == State.TASK_FINISHED:
+            await self.close_deal(State.WORK_COMPLETED)
+            sleep_time = 1
+        return sleep_time
+
+    async def interruptible_step(self):
+        with interruptible(self.stop_event, self.wakeup):
+            try:
+                return await self.step()
+            except CircuitOpenError as e:
+                # Node keeps its state and order or deal, and tries again after the next probe of node api
+                logger.debug("Node {} is paused in state {}: {}".format(self.node_tag, self.status.name, e))
+                return e.retry_in
+
+    async def watch_node(self, engine):
+        self.RUNNING = True
+        self.loop = engine.loop
+        self.api = engine.api
+        self.wakeup = asyncio.Event()
         while self.KEEP_WORK and self.status != State.WORK_COMPLETED:
-            if int(time.time() - self.last_heartbeat) > restart_timeout():
-                self.reset_to_start()
-            if self.status == State.START or self.status == State.CREATE_ORDER:
-                self.create_order()
-                sleep_time = 60
-            elif self.status == State.AWAITING_DEAL:
-                sleep_time = self.check_order()
-            elif self.status == State.DEAL_OPENED:
-                self.start_task()
-                sleep_time = 60
-            elif self.status == State.DEAL_DISAPPEARED:
-                self.status = State.CREATE_ORDER
-                sleep_time = 1
-            elif self.status == State.TASK_RUNNING:
-                sleep_time = self.check_task_status()
-            elif self.status == State.TASK_FAILED_TO_START:
-                self.close_deal(State.CREATE_ORDER, blacklist=True)
-                sleep_time = 1
-            elif self.status == State.TASK_FAILED:
-                self.close_deal(State.CREATE_ORDER)
-                sleep_time = 1
-            elif self.status == State.TASK_BROKEN:
-                self.close_deal(State.CREATE_ORDER)
-                sleep_time = 1
-            elif self.status == State.TASK_FINISHED:
-                self.close_deal(State.WORK_COMPLETED)
-                sleep_time = 1
-            self.wait_sleep(sleep_time)
+            sleep_time = await self.interruptible_step()
+            await self.wait_sleep(sleep_time)
             self.last_heartbeat = time.time()
-        self.logger.info("Node {} stopped, {}"
-                         .format(self.node_tag, "work completed." if self.KEEP_WORK else "received stop signal."))
-
-    def wait_sleep(self, sleep_time):
-        for n in range(0, sleep_time if sleep_time else 60):
-            if self.KEEP_WORK:
-                time.sleep(1)
-            else:
-                return
+        logger.info("Node {} stopped, {}"
+                    .format(self.node_tag, "work completed." if self.KEEP_WORK else "received stop signal."))
+
+    async def wait_sleep(self, sleep_time):
+        if not self.KEEP_WORK:
+            return
+        try:
+            await asyncio.wait_for(self.wakeup.wait(), PollWheel.spread(sleep_time if sleep_time else 60))
+        except asyncio.TimeoutError:
+            pass
+        self.wakeup.clear()
+
+    def wake(self):
+        # Cuts current sleep short, safe to call from any thread
+        if self.loop and self.wakeup and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self.wakeup.set)
 
     def finish_work(self):
-        self.logger.info("Destroying Node {}".format(self.node_tag))
+        logger.info("Destroying Node {}".format(self.node_tag))
         self.KEEP_WORK = False
-        self.purge()
-
-    def reset_to_start(self):
-        self.logger.info("Reset Node {} to start state".format(self.node_tag))
-        self.purge(state_after=State.START)
-
-    def purge(self, state_after=State.WORK_COMPLETED):
+        self.stop_event.set()
+        self.wake()
+        # Order which is being placed is cancelled once it's placed
+        with self.status_changed:
+            self.status_changed.wait_for(lambda: self._status != State.PLACING_ORDER)
+        self.run_sync(self.purge())
+
+    def run_sync(self, coroutine):
+        # Runs node coroutine from another thread: on engine loop if node was started, else on its own loop
+        if self.loop and self.loop.is_running():
+            return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+        if self.api is None:
+            self.api = AsyncSonmApi(self.sonm_api)
+        return asyncio.run(coroutine)
+
+    def adopt_deal(self, status, deal_id, task_id, bid_id, price):
+        # Called from journal verification thread. Node which started placing an order keeps it
+        with self.status_changed:
+            if self.status not in [State.START, State.CREATE_ORDER]:
+                return False
+            self.deal_id = deal_id
+            self.task_id = task_id
+            self.bid_id = bid_id
+            self.price_usd = convert_price(price)
+            self.status = status
+        return True
+
+    async def reset_to_start(self):
+        logger.info("Reset Node {} to start state".format(self.node_tag))
+        await self.purge(state_after=State.START)
+
+    async def purge(self, state_after=State.WORK_COMPLETED):
         if self.status in [State.DEAL_OPENED, State.STARTING_TASK, State.TASK_RUNNING, State.TASK_FAILED,
                            State.TASK_FAILED_TO_START, State.TASK_BROKEN, State.TASK_FINISHED]:
-            self.close_deal(state_after)
+            await self.close_deal(state_after)
         elif self.status == State.AWAITING_DEAL:
-            self.cancel_order()
-        elif self.status == State.PLACING_ORDER:
-            while self.status != State.AWAITING_DEAL:
-                time.sleep(1)
-            self.cancel_order()
+            await self.cancel_order()
         self.status = state_after
 
     def stop_work(self):
         self.KEEP_WORK = False
-        self.logger.debug("Stopping Node {}...".format(self.node_tag))
+        self.stop_event.set()
+        self.wake()
+        logger.debug("Stopping Node {}...".format(self.node_tag))
+
+    def task_logs_args(self, prefix):
+        logs_config = task_logs_config()
+        return ((self.deal_id, self.task_id, logs_config.get("tail", 1000000),
+                 "{}{}-deal-{}.log".format(prefix, self.node_tag, self.deal_id)),
+                {"compress": logs_config.get("compress", False),
+                 "max_bytes": int(logs_config.get("max_bytes", 0)),
+                 "timeout": int(logs_config.get("timeout", 300))})
 
     def save_task_logs(self, prefix):
-        self.sonm_api.task_logs(self.deal_id, self.task_id, "1000000",
-                                "{}{}-deal-{}.log".format(prefix, self.node_tag, self.deal_id))
+        args, kwargs = self.task_logs_args(prefix)
+        self.sonm_api.task_logs(*args, **kwargs)
+
+    async def save_task_logs_async(self, prefix):
+        args, kwargs = self.task_logs_args(prefix)
+        await self.api.task_logs(*args, **kwargs)
 
     @property
     def as_table_item(self):
-        since_hb = int(time.time() - self.last_heartbeat) if self.status != State.WORK_COMPLETED else 0
+        # New row on every call: dashboard render and live rows may read node at the same time
+        status = self.status
+        since_hb = int(time.time() - self.last_heartbeat) if status != State.WORK_COMPLETED else 0
         return TableItem(node=self.node_tag,
                          order_id=self.bid_id,
                          order_price=self.price,
                          deal_id=self.deal_id,
                          task_id=self.task_id,
                          task_uptime=self.task_uptime,
-                         node_status=self.status,
+                         node_status=status,
                          since_hb=since_hb)
 
     @staticmethod
@@ -325,6 +531,9 @@ def get_css_class(node_state: State, since_hb: int):
 
 
 class TableItem(object):
+    __slots__ = ("node", "order_id", "order_price", "deal_id", "task_id", "task_uptime", "node_status", "css_class",
+                 "since_hb")
+
     def __init__(self, node, order_id, order_price, deal_id, task_id, task_uptime, node_status, since_hb):
         self.node = node
         self.order_id = order_id
@@ -1,8 +1,9 @@
 #!/usr/bin/env python3.7
-import concurrent
+import argparse
 import logging
 import os
-import time
+import threading
+from functools import partial
 from logging.config import dictConfig
 from os.path import join
 
@@ -11,7 +12,18 @@ from apscheduler.schedulers.background import BackgroundScheduler
 from source.http_server import run_http_server, SonmHttpServer
 from source.utils import Nodes, print_state, create_dir
 from source.config import Config
-from source.init import init_nodes_state, reload_config, init_sonm_api, check_balance
+from source.drain import drain_nodes
+from source.engine import NodeEngine
+from source.supervisor import Supervisor
+from source.init import init_nodes_state, reload_config, init_sonm_api, check_balance, refresh_prices, \
+    init_journal, place_orders
+from source.journal import Journal
+from source.worknode import task_logs_config
+from source.logqueue import LogQueue
+from source.prices import PriceCache
+from source.retry import SHUTDOWN
+from source.reconciler import Reconciler, reconcile_interval
+from source.shards import Coordinator, ShardLink, shards_number
 
 
 def setup_logging(default_config='logging.yaml', default_level=logging.INFO):
@@ -20,54 +32,98 @@ def setup_logging(default_config='logging.yaml', default_level=logging.INFO):
         dictConfig(config)
     else:
         logging.basicConfig(level=default_level)
+    LogQueue.install()
 
 
-def watch(executor, futures):
-    for node in Nodes.get_nodes_arr():
-        futures[node.node_tag] = executor.submit(node.watch_node)
-        time.sleep(1)
-    while len(futures) > 0:
-        # Clear finished futures
-        for item in [{"tag": node_tag, "future": future} for node_tag, future in futures.items()]:
-            if item["future"].done():
-                exception_ = item["future"].exception()
-                logger.info("Removing Node {} from execution list.".format(item["tag"]))
-                del futures[item["tag"]]
-                if exception_:
-                    logger.exception("Node {} failed with exception".format(item["tag"]), exception_)
-                    Nodes.get_node(item["tag"]).RUNNING = False
-        for node_tag in Nodes.get_nodes_keys():
-            # Destroy nodes, if they aren't exist in reloaded config
-            if node_tag not in Config.node_configs.keys():
-                logger.info("Stopping Node {}. It doesn't exist in configuration".format(node_tag))
-                Nodes.get_node(node_tag).finish_work()
-                logger.info("Removing Node {} from active nodes list.".format(node_tag))
-                Nodes.remove_node(node_tag)
-        for node_tag in Nodes.get_nodes_keys():
-            # Add new nodes to executor:
-            if not Nodes.get_node(node_tag).is_running:
-                logger.info("Adding Node {} to executor".format(node_tag))
-                futures[node_tag] = executor.submit(Nodes.get_node(node_tag).watch_node)
-        time.sleep(1)
-
-
-def main():
+def api_workers():
+    return int(Config.base_config["api_workers"]) if "api_workers" in Config.base_config else 20
+
+
+def log_workers():
+    return int(task_logs_config().get("workers", 4))
+
+
+def stop_nodes():
+    SHUTDOWN.set()
+    for n in Nodes.get_nodes_arr():
+        n.stop_work()
+
+
+def main(sonm_api=None, shards=None, drain=None):
     Config.load_config()
-    sonm_api = init_sonm_api()
-    check_balance(sonm_api)
+    shards = shards or shards_number()
+    if drain is not None:
+        run_drain(sonm_api or init_sonm_api(), drain)
+    elif shards > 1 and not sonm_api:
+        run_coordinator(shards)
+    else:
+        run_nodes(sonm_api or init_sonm_api())
+
+
+def run_drain(sonm_api, tags):
+    # Drains given tags (all tags if none given) and exits, nodes aren't started
+    init_journal()
+    # Deals of orders matched before crash are adopted before drain looks at nodes
+    init_nodes_state(sonm_api, verify_async=False)
+    Reconciler.tick(sonm_api)
+    try:
+        drain_nodes(sonm_api, [node for tag in tags or Nodes.get_tags() for node in Nodes.get_tag_nodes(tag)])
+    finally:
+        Journal.close()
+
+
+def run_shard(shard, shards, states, commands, prices, logs):
+    # Entry point of shard process, it runs only nodes with shard_of(node_tag) == shard
+    LogQueue.restart(logs)
+    Nodes.clear()
+    Config.shard = (shard, shards)
+    try:
+        Config.load_config()
+        PriceCache.shared = True
+        PriceCache.load(prices)
+        run_nodes(init_sonm_api(shards + 1), ShardLink(shard, states, commands))
+    finally:
+        # Process exits without atexit handlers, queued records are sent to coordinator here
+        LogQueue.stop()
+
+
+def run_nodes(sonm_api, link=None):
+    if not link:
+        check_balance(sonm_api)
     Config.load_prices(sonm_api)
+    init_journal()
     init_nodes_state(sonm_api)
+    Reconciler.tick(sonm_api)
     scheduler = BackgroundScheduler()
-    executor = concurrent.futures.ThreadPoolExecutor(max_workers=100)
-    futures_ = dict()
+    engine = NodeEngine(sonm_api, max_workers=api_workers(), log_workers=log_workers())
+    supervisor = Supervisor(engine)
     try:
+        engine.start()
         scheduler.start()
-        scheduler.add_job(print_state, 'interval', seconds=60, id='print_state')
-        scheduler.add_job(reload_config, 'interval', kwargs={"sonm_api": sonm_api}, seconds=60, id='reload_config')
-        scheduler.add_job(check_balance, 'interval', kwargs={"sonm_api": sonm_api}, seconds=600, id='check_balance')
-        executor.submit(run_http_server)
-        watch(executor, futures_)
-        print_state()
+        scheduler.add_job(sonm_api.transport.log_metrics, 'interval', seconds=600, id='transport_metrics')
+        if link:
+            # Config reload, balance, prices, reconcile, state dump and dashboard are handled by coordinator
+            link.start({"reload": partial(reload_config, sonm_api, supervisor), "stop": stop_nodes,
+                        "drain": supervisor.drain_tag, "prices": PriceCache.load, "snapshot": Reconciler.load})
+        else:
+            scheduler.add_job(refresh_prices, 'interval', kwargs={"sonm_api": sonm_api}, seconds=60,
+                              id='refresh_prices')
+            scheduler.add_job(Reconciler.tick, 'interval', kwargs={"sonm_api": sonm_api},
+                              seconds=reconcile_interval(), id='reconcile')
+            scheduler.add_job(print_state, 'interval', seconds=60, id='print_state')
+            scheduler.add_job(reload_config, 'interval', kwargs={"sonm_api": sonm_api, "supervisor": supervisor},
+                              seconds=60, id='reload_config')
+            scheduler.add_job(check_balance, 'interval', kwargs={"sonm_api": sonm_api}, seconds=600,
+                              id='check_balance')
+            SonmHttpServer.drain = supervisor.drain_tag
+            threading.Thread(target=run_http_server, name="http-server", daemon=True).start()
+        place_orders(Nodes.get_nodes_arr())
+        # New orders get into reconciler snapshot right away, nodes poll them without asking node api
+        Reconciler.tick(sonm_api)
+        supervisor.schedule_all()
+        supervisor.wait()
+        if not link:
+            print_state()
         logger.info("Work completed")
     except KeyboardInterrupt:
         logger.info("Keyboard interrupt, script exiting")
@@ -75,10 +131,42 @@ def main():
         logger.exception("System Exit", e)
     finally:
         logger.info("Script exiting. Sonm node will continue work")
-        for n in Nodes.get_nodes_arr():
-            n.stop_work()
+        stop_nodes()
+        SonmHttpServer.KEEP_RUNNING = False
+        engine.stop()
+        scheduler.shutdown(wait=False)
+        if link:
+            link.close()
+        Journal.close()
+
+
+def run_coordinator(shards):
+    sonm_api = init_sonm_api(shards + 1)
+    check_balance(sonm_api)
+    Config.load_prices(sonm_api)
+    coordinator = Coordinator(shards, run_shard)
+    scheduler = BackgroundScheduler()
+    try:
+        coordinator.start()
+        scheduler.start()
+        scheduler.add_job(print_state, 'interval', seconds=60, id='print_state')
+        scheduler.add_job(coordinator.reload_config, 'interval', kwargs={"sonm_api": sonm_api}, seconds=60,
+                          id='reload_config')
+        scheduler.add_job(coordinator.refresh_prices, 'interval', kwargs={"sonm_api": sonm_api}, seconds=60,
+                          id='refresh_prices')
+        scheduler.add_job(coordinator.reconcile, 'interval', kwargs={"sonm_api": sonm_api},
+                          seconds=reconcile_interval(), id='reconcile')
+        scheduler.add_job(check_balance, 'interval', kwargs={"sonm_api": sonm_api}, seconds=600, id='check_balance')
+        SonmHttpServer.drain = coordinator.drain_tag
+        threading.Thread(target=run_http_server, name="http-server", daemon=True).start()
+        coordinator.wait()
+        print_state()
+        logger.info("Work completed")
+    except KeyboardInterrupt:
+        logger.info("Keyboard interrupt, stopping shards")
+    finally:
+        coordinator.stop()
         SonmHttpServer.KEEP_RUNNING = False
-        executor.shutdown(wait=False)
         scheduler.shutdown(wait=False)
 
 
@@ -88,5 +176,10 @@ logging.getLogger('apscheduler').setLevel(logging.FATAL)
 logger = logging.getLogger('monitor')
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="SONM task manager")
+    parser.add_argument("--shards", type=int, help="number of processes to split nodes across (default 1)")
+    parser.add_argument("--drain", nargs="*", metavar="TAG",
+                        help="cancel orders and close deals of given tags (all tags if none given) and exit")
+    args = parser.parse_args()
     print('Press Ctrl+{0} to interrupt script'.format('Break' if os.name == 'nt' else 'C'))
-    main()
+    main(shards=args.shards, drain=args.drain)
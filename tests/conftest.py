@@ -0,0 +1,26 @@
+import pytest
+
+from source.config import Config
+from source.journal import Journal
+from source.prices import PriceCache
+from source.utils import Nodes
+from tests.helpers import write_configs
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    # Config files of test fleet in a temporary folder, class level state is reset around each test
+    write_configs(tmp_path, 3)
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(Config, "base_config", {})
+    monkeypatch.setattr(Config, "node_configs", {})
+    monkeypatch.setattr(Config, "bids", {})
+    monkeypatch.setattr(Config, "price_keys", {})
+    monkeypatch.setattr(Config, "files", {})
+    monkeypatch.setattr(Config, "shard", None)
+    monkeypatch.setattr(PriceCache, "entries", {})
+    Nodes.clear()
+    yield tmp_path
+    Journal.close()
+    Nodes.clear()
+
@@ -0,0 +1,42 @@
+import json
+import os
+
+BASE_CONFIG = {
+    "http_server": {"run": False},
+    "node_address": "",
+    "ethereum": {"key_path": "", "password": ""},
+    "journal": False,
+    "tasks": ["test_config.yaml"],
+}
+
+TASK_CONFIG = {
+    "numberofnodes": 3, "tag": "TEST", "price_coefficient": 10, "max_price": "0.02", "ets": 180,
+    "task_start_timeout": 600, "template_file": "test_task.yaml", "duration": "0h", "counterparty": "",
+    "identity": "anonymous", "ramsize": 2000, "storagesize": 1, "cpucores": 1, "sysbenchsingle": 500,
+    "sysbenchmulti": 1000, "netdownload": 10, "netupload": 10, "overlay": False, "incoming": False, "gpucount": 0,
+    "gpumem": 0, "ethhashrate": 0, "cashhashrate": 0,
+}
+
+TASK_TEMPLATE = """container:
+  image: "sonm/test:latest"
+"""
+
+
+def write_configs(folder, nodes):
+    # JSON is valid YAML, configs are written as JSON to be changed by tests
+    conf = os.path.join(str(folder), "conf")
+    os.makedirs(conf)
+    for filename, data in [("config.yaml", BASE_CONFIG), ("test_config.yaml", dict(TASK_CONFIG, numberofnodes=nodes))]:
+        with open(os.path.join(conf, filename), "w") as f:
+            json.dump(data, f)
+    with open(os.path.join(conf, "test_task.yaml"), "w") as f:
+        f.write(TASK_TEMPLATE)
+
+
+def update_task_config(folder, **changes):
+    path = os.path.join(str(folder), "conf", "test_config.yaml")
+    with open(path) as f:
+        config_ = json.load(f)
+    config_.update(changes)
+    with open(path, "w") as f:
+        json.dump(config_, f)
@@ -0,0 +1,54 @@
+import time
+
+import pytest
+
+from source.breaker import CircuitBreaker, CircuitOpenError
+
+
+def fail(breaker, times):
+    for _ in range(times):
+        breaker.before_call()
+        breaker.record(False)
+
+
+def test_opens_after_threshold_failures():
+    breaker = CircuitBreaker(threshold=3, reset_timeout=30)
+    fail(breaker, 2)
+    assert not breaker.is_open()
+    fail(breaker, 1)
+    assert breaker.is_open()
+    with pytest.raises(CircuitOpenError) as e:
+        breaker.before_call()
+    assert 1 <= e.value.retry_in <= 30
+
+
+def test_healthy_response_resets_failures():
+    breaker = CircuitBreaker(threshold=3, reset_timeout=30)
+    fail(breaker, 2)
+    breaker.record(True)
+    fail(breaker, 2)
+    assert not breaker.is_open()
+
+
+def test_probe_closes_or_opens_again():
+    breaker = CircuitBreaker(threshold=1, reset_timeout=0.05)
+    fail(breaker, 1)
+    time.sleep(0.06)
+    breaker.before_call()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    # Only one probe is let through
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    breaker.record(False)
+    assert breaker.state == CircuitBreaker.OPEN
+    time.sleep(0.06)
+    breaker.before_call()
+    breaker.record(True)
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.before_call()
+
+
+def test_zero_threshold_disables_breaker():
+    breaker = CircuitBreaker(threshold=0)
+    fail(breaker, 10)
+    assert not breaker.is_open()
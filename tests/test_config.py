@@ -0,0 +1,39 @@
+from source.config import Config
+from source.utils import shard_of
+from tests.helpers import update_task_config
+
+
+def test_first_load_adds_all_nodes(workdir):
+    diff = Config.load_config()
+    assert diff.added == {"TEST_1", "TEST_2", "TEST_3"}
+    assert not diff.removed and not diff.changed
+    assert diff.changed_bids == {"TEST"}
+
+
+def test_unchanged_file_gives_empty_diff(workdir):
+    Config.load_config()
+    update_task_config(workdir)
+    diff = Config.load_config()
+    assert not (diff.added or diff.removed or diff.changed or diff.changed_bids)
+
+
+def test_removed_and_changed_nodes(workdir):
+    Config.load_config()
+    update_task_config(workdir, numberofnodes=2, price_coefficient=20)
+    diff = Config.load_config()
+    assert diff.removed == {"TEST_3"}
+    assert diff.changed == {"TEST_1", "TEST_2"}
+    assert not diff.changed_bids
+
+
+def test_changed_resources_change_bid(workdir):
+    Config.load_config()
+    update_task_config(workdir, ramsize=4000)
+    assert Config.load_config().changed_bids == {"TEST"}
+
+
+def test_shard_loads_only_its_nodes(workdir):
+    Config.shard = (1, 2)
+    diff = Config.load_config()
+    assert Config.fleet_size == 3
+    assert diff.added == {ntag for ntag in ["TEST_1", "TEST_2", "TEST_3"] if shard_of(ntag, 2) == 1}
@@ -0,0 +1,72 @@
+import threading
+
+import pytest
+
+from source.config import Config
+from source.drain import drain_nodes
+from source.reconciler import Reconciler
+from source.utils import Nodes, parse_price
+from source.worknode import State, WorkNode
+
+
+class FakeApi(object):
+    def __init__(self, failed_orders=(), failed_deals=()):
+        self.failed_orders = failed_orders
+        self.failed_deals = failed_deals
+        self.cancelled = []
+        self.closed = []
+        self.lock = threading.Lock()
+
+    def order_cancel_many(self, order_ids, batch):
+        self.cancelled.append(order_ids)
+        self.batch = batch
+        return [order_id for order_id in order_ids if order_id in self.failed_orders]
+
+    def deal_close(self, deal_id, bl_worker=False):
+        with self.lock:
+            self.closed.append(deal_id)
+        return None if deal_id in self.failed_deals else {}
+
+
+@pytest.fixture
+def fleet(workdir, monkeypatch):
+    Config.load_config()
+    monkeypatch.setattr(Reconciler, "orders_by_tag", {})
+    price_ = parse_price("0.01USD/h")
+
+    def create(api, rows):
+        for node_tag, status, bid_id, deal_id in rows:
+            Nodes.add_node(WorkNode(status, api, node_tag, deal_id, "", bid_id, price_))
+        return Nodes.get_nodes_arr()
+
+    return create
+
+
+def test_orders_are_cancelled_and_deals_closed(fleet):
+    api = FakeApi()
+    nodes_ = fleet(api, [("TEST_1", State.AWAITING_DEAL, "5", ""), ("TEST_2", State.TASK_RUNNING, "6", "10"),
+                         ("TEST_3", State.START, "", "")])
+    # Order placed right before restart is on market, but node doesn't know it
+    Reconciler.orders_by_tag = {"TEST_3": {"id": "7"}}
+    drain_nodes(api, nodes_)
+    assert api.cancelled == [["5", "7"]]
+    assert api.closed == ["10"]
+    assert [node.status for node in nodes_] == [State.WORK_COMPLETED] * 3
+    assert all(not node.KEEP_WORK for node in nodes_)
+    assert Nodes.get_node("TEST_2").deal_id == ""
+
+
+def test_failed_nodes_keep_their_orders_and_deals(fleet):
+    api = FakeApi(failed_orders=["5"], failed_deals=["10"])
+    nodes_ = fleet(api, [("TEST_1", State.AWAITING_DEAL, "5", ""), ("TEST_2", State.DEAL_OPENED, "6", "10")])
+    drain_nodes(api, nodes_)
+    assert (nodes_[0].status, nodes_[0].bid_id) == (State.AWAITING_DEAL, "5")
+    assert (nodes_[1].status, nodes_[1].deal_id) == (State.DEAL_OPENED, "10")
+
+
+def test_batch_size_from_config(fleet):
+    api = FakeApi()
+    nodes_ = fleet(api, [("TEST_{}".format(n), State.AWAITING_DEAL, str(n), "") for n in range(1, 4)])
+    Config.base_config["drain"] = {"batch": 2}
+    drain_nodes(api, nodes_)
+    assert api.batch == 2
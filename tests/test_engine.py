@@ -0,0 +1,122 @@
+import base64
+import os
+import threading
+import time
+
+import pytest
+import requests
+
+from source.config import Config
+from source.engine import NodeEngine
+from source.sonmapi import SonmApi
+from source.utils import Nodes, TaskStatus
+from source.worknode import State, WorkNode
+
+FAST_POLLING = {"awaiting_deal": {"min": 0.1, "max": 0.1}, "spooling": {"min": 0.1, "max": 0.1},
+                "running": {"min": 0.1, "max": 0.1}}
+
+
+class MarketNode(object):
+    # Node api client of a market where every order is matched right away and tasks go through given statuses
+    def __init__(self, task_statuses):
+        self.eth_addr = "0x" + "0" * 40
+        self.session = requests.Session()
+        self.task_statuses = list(task_statuses)
+        self.lock = threading.Lock()
+        self.orders = []
+        self.closed = []
+        self.order = Group({"create": self.order_create, "status": self.order_status})
+        self.deal = Group({"status": self.deal_status, "close": self.deal_close})
+        self.task = Group({"start": self.task_start, "status": self.task_status})
+
+    def order_create(self, order):
+        with self.lock:
+            self.orders.append(order)
+            return {"id": str(len(self.orders))}
+
+    def order_status(self, order_id):
+        tag = base64.b64encode(self.orders[int(order_id) - 1]["tag"].encode()).decode()
+        return {"orderStatus": 1, "tag": tag, "dealID": "10" + order_id}
+
+    def deal_status(self, deal_id):
+        status = 2 if deal_id in self.closed else 1
+        return {"deal": {"status": status, "bidID": deal_id[2:], "price": "1000"}, "resources": {}}
+
+    def deal_close(self, deal_id, blacklist):
+        with self.lock:
+            self.closed.append((deal_id, blacklist))
+        return {}
+
+    def task_start(self, deal_id, task):
+        return {"id": "task-" + deal_id}
+
+    def task_status(self, deal_id, task_id):
+        status, uptime = self.task_statuses.pop(0) if len(self.task_statuses) > 1 else self.task_statuses[0]
+        return {"status": status.value, "uptime": str(int(uptime * 1e9))}
+
+
+class Group(object):
+    def __init__(self, methods):
+        self.methods = methods
+
+    def __getattr__(self, method):
+        def call(*args, timeout=60):
+            return dict(self.methods[method](*args), status_code=200)
+
+        return call
+
+
+@pytest.fixture
+def engine(workdir, monkeypatch):
+    Config.load_config()
+    Config.base_config["polling"] = FAST_POLLING
+    os.makedirs("out/orders")
+    # Task logs are fetched with sonmcli, it isn't run by tests
+    monkeypatch.setattr(SonmApi, "task_logs", staticmethod(lambda *args, **kwargs: 0))
+    engines = []
+
+    def start(market):
+        engine_ = NodeEngine(SonmApi("", "", "", 1, node=market), max_workers=4, log_workers=1)
+        engine_.start()
+        engines.append(engine_)
+        return engine_
+
+    yield start
+    for engine_ in engines:
+        engine_.stop()
+
+
+def run_node(engine_, node, until, timeout=10):
+    # Node sleeps 15 sec after deal is opened, waking it up keeps the test short
+    future = engine_.submit(node)
+    deadline = time.time() + timeout
+    while not until(node) and time.time() < deadline:
+        node.wake()
+        time.sleep(0.05)
+    return future
+
+
+def test_node_runs_task_to_completion(engine):
+    market = MarketNode([(TaskStatus.running, 5), (TaskStatus.finished, 10)])
+    engine_ = engine(market)
+    node = WorkNode.create_empty(engine_.sonm_api, "TEST_1")
+    Nodes.add_node(node)
+    future = run_node(engine_, node, lambda node_: node_.status == State.WORK_COMPLETED)
+    future.result(5)
+    assert node.status == State.WORK_COMPLETED
+    assert [order["tag"] for order in market.orders] == ["TEST_1"]
+    assert market.closed == [("101", False)]
+    assert (node.deal_id, node.task_id, node.bid_id) == ("", "", "")
+
+
+def test_task_failed_before_ets_blacklists_worker_and_orders_again(engine):
+    market = MarketNode([(TaskStatus.broken, 5), (TaskStatus.running, 5)])
+    engine_ = engine(market)
+    node = WorkNode.create_empty(engine_.sonm_api, "TEST_2")
+    Nodes.add_node(node)
+    future = run_node(engine_, node, lambda node_: node_.status == State.TASK_RUNNING and node_.deal_id == "102")
+    assert market.closed == [("101", True)]
+    assert node.task_id == "task-102"
+    node.stop_work()
+    future.result(5)
+    assert node.status == State.TASK_RUNNING
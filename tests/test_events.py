@@ -0,0 +1,66 @@
+import collections
+import json
+
+import pytest
+
+from source.config import Config
+from source.http_server import LiveRows, create_app
+from source.utils import Nodes
+from source.worknode import State, WorkNode
+
+
+@pytest.fixture
+def nodes(workdir, monkeypatch):
+    Config.load_config()
+    Config.base_config["http_server"] = {"user": "u", "password": "p", "event_interval": 0}
+    monkeypatch.setattr(LiveRows, "rows", {})
+    monkeypatch.setattr(LiveRows, "changes", collections.deque(maxlen=100))
+    monkeypatch.setattr(LiveRows, "seq", 0)
+    monkeypatch.setattr(LiveRows, "updated", 0)
+    for node_tag in Config.node_configs:
+        Nodes.add_node(WorkNode.create_empty(None, node_tag))
+    return Nodes.get_nodes_arr()
+
+
+def test_new_page_gets_all_rows(nodes):
+    LiveRows.update()
+    seq, changed_, removed_ = LiveRows.since(None)
+    assert seq == 1
+    assert sorted(changed_) == ["TEST_1", "TEST_2", "TEST_3"]
+    assert changed_["TEST_1"]["node_status"] == "START"
+    assert removed_ == []
+
+
+def test_page_gets_changes_since_its_event(nodes):
+    LiveRows.update()
+    seq, _, _ = LiveRows.since(None)
+    Nodes.get_node("TEST_2").status = State.AWAITING_DEAL
+    Nodes.remove_node("TEST_3")
+    LiveRows.update()
+    seq, changed_, removed_ = LiveRows.since(seq)
+    assert list(changed_) == ["TEST_2"]
+    assert changed_["TEST_2"]["css_class"] == "table-info"
+    assert removed_ == ["TEST_3"]
+    LiveRows.update()
+    assert LiveRows.since(seq) == (seq, {}, [])
+
+
+def test_page_which_missed_changes_gets_all_rows(nodes):
+    LiveRows.update()
+    node_ = Nodes.get_node("TEST_1")
+    for n in range(101):
+        node_.task_uptime = n + 1
+        LiveRows.update()
+    seq, changed_, removed_ = LiveRows.since(1)
+    assert seq == 102 and len(changed_) == 3
+
+
+def test_events_endpoint_streams_rows(nodes):
+    client = create_app().test_client()
+    assert client.get("/events").status_code == 401
+    response = client.get("/events", headers={"Authorization": "Basic dTpw"})
+    assert response.mimetype == "text/event-stream"
+    event_ = next(iter(response.response)).decode()
+    response.close()
+    assert event_.startswith("data: ") and event_.endswith("\n\n")
+    assert sorted(json.loads(event_[len("data: "):])["rows"]) == ["TEST_1", "TEST_2", "TEST_3"]
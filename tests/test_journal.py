@@ -0,0 +1,77 @@
+from source.config import Config
+from source.init import restore_nodes_state, verify_nodes_state
+from source.journal import Journal
+from source.utils import Nodes, parse_price
+from source.worknode import State, WorkNode
+
+
+class FakeApi(object):
+    def __init__(self, orders, deals=()):
+        self.orders = orders
+        self.deals = list(deals)
+
+    def order_list(self, limit):
+        return {"orders": self.orders}
+
+    def deal_list(self, limit):
+        return [{"id": deal_["id"], "bid_id": deal_["bid_id"]} for deal_ in self.deals]
+
+    def deal_status(self, deal_id):
+        deal_ = [deal_ for deal_ in self.deals if deal_["id"] == deal_id][0]
+        return {"status": 1, "bid_id": deal_["bid_id"], "running": ["task"], "worker_offline": False,
+                "price": "1000"}
+
+    def order_status(self, order_id):
+        deal_ = [deal_ for deal_ in self.deals if deal_["bid_id"] == order_id][0]
+        return {"orderStatus": 1, "tag": deal_["tag"], "dealID": deal_["id"]}
+
+
+def journal_rows(rows):
+    Journal.open("state.db")
+    for node_tag, status, bid_id, deal_id, task_id in rows:
+        WorkNode(status, None, node_tag, deal_id, task_id, bid_id, parse_price("0.01USD/h"))
+    Nodes.clear()
+
+
+def test_restore_from_journal(workdir):
+    Config.load_config()
+    journal_rows([("TEST_1", State.TASK_RUNNING, "5", "6", "7"),
+                  ("TEST_2", State.PLACING_ORDER, "", "", ""),
+                  ("TEST_3", State.PLACING_ORDER, "", "", ""),
+                  ("OTHER_1", State.TASK_RUNNING, "1", "2", "3")])
+    restored, unplaced = restore_nodes_state(FakeApi([{"id": "8", "tag": "TEST_2"}]))
+    assert restored and unplaced == 1
+    assert sorted(node.node_tag for node in Nodes.get_nodes_arr()) == ["TEST_1", "TEST_2", "TEST_3"]
+    running = Nodes.get_node("TEST_1")
+    assert (running.status, running.bid_id, running.deal_id, running.task_id) == (State.TASK_RUNNING, "5", "6", "7")
+    assert running.price == "0.0100 USD/h"
+    # Order placed before crash is found on market, order which isn't there may be matched already
+    assert (Nodes.get_node("TEST_2").status, Nodes.get_node("TEST_2").bid_id) == (State.AWAITING_DEAL, "8")
+    assert Nodes.get_node("TEST_3").status == State.CREATE_ORDER
+
+
+def test_completed_nodes_are_not_restored(workdir):
+    Config.load_config()
+    journal_rows([("TEST_1", State.WORK_COMPLETED, "", "", ""), ("TEST_2", State.START, "", "", "")])
+    assert restore_nodes_state(FakeApi([])) == (False, 0)
+
+
+def test_matched_order_of_placing_node_is_adopted(workdir):
+    Config.load_config()
+    journal_rows([("TEST_1", State.PLACING_ORDER, "", "", ""), ("TEST_2", State.AWAITING_DEAL, "3", "", "")])
+    api = FakeApi([], [{"id": "9", "bid_id": "8", "tag": "TEST_1"}, {"id": "10", "bid_id": "4", "tag": "TEST_2"}])
+    assert restore_nodes_state(api) == (True, 1)
+    verify_nodes_state(api)
+    adopted = Nodes.get_node("TEST_1")
+    assert (adopted.status, adopted.deal_id, adopted.task_id, adopted.bid_id) == (State.TASK_RUNNING, "9", "task", "8")
+    # Node which has its own order isn't changed
+    assert (Nodes.get_node("TEST_2").status, Nodes.get_node("TEST_2").deal_id) == (State.AWAITING_DEAL, "")
+    # Adopted node doesn't place an order
+    assert adopted.place_order({}) is False
+
+
+def test_node_placing_order_keeps_it(workdir):
+    Config.load_config()
+    node_ = WorkNode(State.PLACING_ORDER, None, "TEST_1", "", "", "", "")
+    assert not node_.adopt_deal(State.DEAL_OPENED, "9", "", "8", "1000")
+    assert (node_.status, node_.deal_id) == (State.PLACING_ORDER, "")
@@ -0,0 +1,65 @@
+import threading
+import time
+
+from source.init import split_rate_limit
+from source.limiter import ApiLimiter, PRIORITIES
+
+
+def acquire_in_thread(limiter, endpoint, order):
+    def run():
+        limiter.acquire(endpoint)
+        order.append(endpoint)
+        limiter.release()
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread
+
+
+def test_waiting_requests_go_by_priority():
+    limiter = ApiLimiter(rate=0, max_in_flight=1)
+    limiter.acquire("task_status")
+    order = []
+    threads = [acquire_in_thread(limiter, "order_status", order)]
+    time.sleep(0.05)
+    threads.append(acquire_in_thread(limiter, "deal_close", order))
+    time.sleep(0.05)
+    limiter.release()
+    for thread in threads:
+        thread.join(1)
+    assert order == ["deal_close", "order_status"]
+
+
+def test_same_priority_goes_in_order_of_arrival():
+    limiter = ApiLimiter(rate=0, max_in_flight=1)
+    limiter.acquire("task_status")
+    order = []
+    threads = []
+    for endpoint in ["deal_list", "order_list", "deal_status"]:
+        threads.append(acquire_in_thread(limiter, endpoint, order))
+        time.sleep(0.05)
+    limiter.release()
+    for thread in threads:
+        thread.join(1)
+    assert order == ["deal_list", "order_list", "deal_status"]
+
+
+def test_rate_limit_after_burst():
+    limiter = ApiLimiter(rate=20, burst=2, max_in_flight=10)
+    waits = [limiter.acquire("task_status") for _ in range(3)]
+    assert waits[0] < 0.01 and waits[1] < 0.01
+    assert 0.03 < waits[2] < 0.2
+    assert limiter.in_flight == 3
+
+
+def test_reconciler_lists_are_not_behind_status_polls():
+    for endpoint in ["order_list", "deal_list"]:
+        assert PRIORITIES[endpoint] <= PRIORITIES["order_status"]
+        assert PRIORITIES[endpoint] <= PRIORITIES["task_status"]
+
+
+def test_rate_limit_is_split_between_shard_processes():
+    assert split_rate_limit({}, 20, 1) == {"rate": 50.0, "burst": 100.0, "max_in_flight": 20}
+    assert split_rate_limit({"rate": 40, "burst": 80, "max_in_flight": 6}, 20, 5) == \
+        {"rate": 8.0, "burst": 16.0, "max_in_flight": 1}
+    assert split_rate_limit({"rate": 0}, 20, 3)["rate"] == 0
@@ -0,0 +1,47 @@
+import logging
+import multiprocessing
+import queue
+
+from source.logqueue import LogQueue, RoutedQueueHandler
+
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(self.format(record))
+
+
+def log_in_shard(queue_):
+    LogQueue.restart(queue_)
+    logger_ = logging.getLogger("test_shard")
+    logger_.info("Shard started")
+    try:
+        raise ValueError("failed")
+    except ValueError:
+        logger_.exception("Shard failed")
+    LogQueue.stop()
+
+
+def test_shard_records_are_written_by_coordinator(monkeypatch):
+    handler = ListHandler()
+    queue_handler = RoutedQueueHandler(queue.Queue(), "test_shard")
+    logger_ = logging.getLogger("test_shard")
+    logger_.setLevel(logging.INFO)
+    logger_.addHandler(queue_handler)
+    monkeypatch.setattr(LogQueue, "queue_handlers", [queue_handler])
+    monkeypatch.setattr(LogQueue, "routes", {"test_shard": [handler]})
+    monkeypatch.setattr(LogQueue, "shard_listeners", {})
+    try:
+        process = multiprocessing.get_context("fork").Process(target=log_in_shard, args=(LogQueue.open_shard(0),))
+        process.start()
+        process.join(10)
+        LogQueue.close_shard(0)
+    finally:
+        logger_.removeHandler(queue_handler)
+    assert process.exitcode == 0
+    assert handler.messages[0] == "Shard started"
+    assert handler.messages[1].startswith("Shard failed\nTraceback")
+    assert "ValueError: failed" in handler.messages[1]
@@ -0,0 +1,61 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from source.config import Config
+from source.http_server import create_app
+from source.metrics import Metrics
+from source.worknode import State
+
+
+@pytest.fixture(autouse=True)
+def metrics(monkeypatch):
+    for name in ["latency", "queue_wait", "errors", "retries", "shards"]:
+        monkeypatch.setattr(Metrics, name, {})
+
+
+def test_latency_histogram_is_cumulative():
+    Metrics.observe_latency("deal_status", 0.2)
+    Metrics.observe_latency("deal_status", 3)
+    lines = Metrics.render_api()
+    assert 'sonm_api_request_duration_seconds_bucket{method="deal_status",le="0.1"} 0' in lines
+    assert 'sonm_api_request_duration_seconds_bucket{method="deal_status",le="0.25"} 1' in lines
+    assert 'sonm_api_request_duration_seconds_bucket{method="deal_status",le="5"} 2' in lines
+    assert 'sonm_api_request_duration_seconds_bucket{method="deal_status",le="+Inf"} 2' in lines
+    assert 'sonm_api_request_duration_seconds_sum{method="deal_status"} 3.200000' in lines
+
+
+def test_shard_metrics_are_merged():
+    Metrics.inc_error("order_create")
+    Metrics.observe_queue_wait("order_create", 0.01)
+    shard_ = Metrics.snapshot()
+    Metrics.update_shard(0, shard_)
+    Metrics.update_shard(1, shard_)
+    lines = Metrics.render_api()
+    assert 'sonm_api_errors_total{method="order_create"} 3' in lines
+    assert 'sonm_api_queue_wait_seconds_count{method="order_create"} 3' in lines
+
+
+def test_node_gauges_and_heartbeat_lag():
+    now = time.time()
+    nodes = [SimpleNamespace(tag="A", status=State.TASK_RUNNING, last_heartbeat=now - 30),
+             SimpleNamespace(tag="A", status=State.WORK_COMPLETED, last_heartbeat=now - 900)]
+    counts = {("A", State.TASK_RUNNING): 1, ("A", State.WORK_COMPLETED): 1}
+    lines = Metrics.render_nodes(nodes, counts, [State.TASK_RUNNING, State.WORK_COMPLETED, State.START],
+                                 State.WORK_COMPLETED)
+    assert 'taskman_nodes{tag="A",state="TASK_RUNNING"} 1' in lines
+    assert 'taskman_nodes{tag="A",state="START"} 0' in lines
+    lag_ = [line for line in lines if line.startswith("taskman_heartbeat_lag_seconds{")]
+    assert len(lag_) == 1 and 30 <= float(lag_[0].split()[-1]) < 60
+
+
+def test_metrics_endpoint_requires_auth(monkeypatch):
+    monkeypatch.setattr(Config, "base_config", {"http_server": {"user": "u", "password": "p"}})
+    Metrics.inc_retry("task_status")
+    client = create_app().test_client()
+    assert client.get("/metrics").status_code == 401
+    response = client.get("/metrics", headers={"Authorization": "Basic dTpw"})
+    assert response.status_code == 200
+    assert response.mimetype == "text/plain"
+    assert 'sonm_api_retries_total{method="task_status"} 1' in response.get_data(as_text=True).splitlines()
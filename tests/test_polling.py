@@ -0,0 +1,38 @@
+import pytest
+
+from source.config import Config
+from source.polling import Polling, PollWheel
+
+
+@pytest.fixture(autouse=True)
+def wheel(monkeypatch):
+    monkeypatch.setattr(Config, "base_config", {})
+    monkeypatch.setattr(PollWheel, "slots", {})
+    monkeypatch.setattr(PollWheel, "pruned", 0)
+
+
+def test_interval_grows_with_state_age():
+    assert Polling.interval("awaiting_deal", 0) == 5
+    assert Polling.interval("awaiting_deal", 300) == 30
+    assert Polling.interval("awaiting_deal", 3600) == 60
+    assert Polling.interval("running", 0) == 60
+
+
+def test_interval_bounds_from_config():
+    Config.base_config = {"polling": {"ratio": 0.5, "spooling": {"min": 1, "max": 10}}}
+    assert Polling.interval("spooling", 0) == 1
+    assert Polling.interval("spooling", 6) == 3
+    assert Polling.interval("spooling", 60) == 10
+    assert Polling.api_interval() == 60
+
+
+def test_short_delays_are_not_spread():
+    assert PollWheel.spread(2) == 2
+    assert PollWheel.slots == {}
+
+
+def test_polls_are_spread_across_slots():
+    delays = [PollWheel.spread(40) for _ in range(11)]
+    assert all(40 <= delay <= 50 for delay in delays)
+    # Window of ten seconds has eleven slots, each of them gets one poll
+    assert sorted(PollWheel.slots.values()) == [1] * 11
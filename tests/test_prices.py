@@ -0,0 +1,80 @@
+import threading
+import time
+
+import pytest
+
+from source.breaker import CircuitOpenError
+from source.prices import PriceCache, resources_key
+
+GPU = {"gpu": 1}
+CPU = {"cpu": 4}
+
+
+class FakeApi(object):
+    def __init__(self, price=10, error=None):
+        self.price = price
+        self.error = error
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def predict_bid(self, resources):
+        with self.lock:
+            self.calls.append(resources)
+        if self.error:
+            raise self.error
+        return self.price
+
+
+@pytest.fixture(autouse=True)
+def cache(monkeypatch):
+    monkeypatch.setattr(PriceCache, "entries", {})
+    monkeypatch.setattr(PriceCache, "shared", False)
+
+
+def test_identical_resources_are_predicted_once():
+    api = FakeApi()
+    keys = [PriceCache.add(dict(GPU)), PriceCache.add(dict(GPU)), PriceCache.add(CPU)]
+    assert keys[0] == keys[1] == resources_key(GPU)
+    assert PriceCache.refresh(api) == 2
+    assert sorted(api.calls, key=str) == [CPU, GPU]
+    assert PriceCache.get(keys[0]) == 10
+
+
+def test_fresh_prices_are_not_predicted_again():
+    api = FakeApi()
+    key = PriceCache.add(GPU)
+    PriceCache.refresh(api)
+    assert PriceCache.refresh(api) == 0
+    PriceCache.entries[key]["updated"] -= PriceCache.ttl
+    assert PriceCache.refresh(api, [key]) == 1
+    assert len(api.calls) == 2
+
+
+def test_previous_price_is_kept_while_breaker_is_open():
+    key = PriceCache.add(GPU)
+    PriceCache.refresh(FakeApi(price=10))
+    PriceCache.entries[key]["updated"] = 0
+    PriceCache.refresh(FakeApi(error=CircuitOpenError(10)))
+    assert PriceCache.get(key) == 10
+    assert PriceCache.expired() == [(key, GPU)]
+
+
+def test_shards_load_prices_instead_of_predicting():
+    key = PriceCache.add(GPU)
+    PriceCache.refresh(FakeApi(price=10))
+    exported = PriceCache.export()
+    PriceCache.entries = {}
+    PriceCache.shared = True
+    api = FakeApi()
+    PriceCache.add(GPU)
+    assert PriceCache.refresh(api) == 0 and api.calls == []
+    PriceCache.load(exported)
+    assert PriceCache.get(key) == 10
+    assert time.time() - PriceCache.entries[key]["updated"] < PriceCache.ttl
+
+
+def test_retain_drops_unused_entries():
+    key = PriceCache.add(GPU)
+    PriceCache.add(CPU)
+    PriceCache.retain([key])
+    assert list(PriceCache.entries) == [key]
@@ -0,0 +1,72 @@
+import pytest
+
+from source.breaker import CircuitOpenError
+from source.config import Config
+from source.reconciler import Reconciler
+
+
+class FakeApi(object):
+    def __init__(self, orders, deals):
+        self.orders = orders
+        self.deals = deals
+
+    def order_list(self, limit):
+        if isinstance(self.orders, Exception):
+            raise self.orders
+        return {"orders": self.orders[:limit]}
+
+    def deal_list(self, limit):
+        return self.deals[:limit]
+
+
+@pytest.fixture(autouse=True)
+def snapshot(monkeypatch):
+    for name, value in [("orders", {}), ("orders_by_tag", {}), ("deals", {}), ("deals_by_bid", {}),
+                        ("known_deals", set()), ("orders_complete", False), ("deals_complete", False),
+                        ("updated", 0)]:
+        monkeypatch.setattr(Reconciler, name, value)
+    monkeypatch.setattr(Config, "base_config", {})
+    monkeypatch.setattr(Config, "fleet_size", 2)
+
+
+def test_order_states_from_snapshot():
+    Reconciler.tick(FakeApi([{"id": "1", "tag": "A_1"}], [{"id": "10", "bid_id": "2"}]))
+    assert Reconciler.order_status("1") == {"orderStatus": 2, "tag": "A_1", "dealID": "0"}
+    assert Reconciler.order_status("2") == {"orderStatus": 1, "tag": None, "dealID": "10"}
+    # Order placed after snapshot is unknown, node asks node api
+    assert Reconciler.order_status("3") is None
+
+
+def test_deal_is_closed_only_if_previous_snapshot_has_seen_it():
+    Reconciler.tick(FakeApi([], [{"id": "10", "bid_id": "2"}]))
+    assert Reconciler.deal_status("10") == {"status": 1}
+    assert Reconciler.deal_status("11") is None
+    Reconciler.tick(FakeApi([], []))
+    assert Reconciler.deal_status("10") == {"status": 2}
+    assert Reconciler.deal_status("11") is None
+
+
+def test_truncated_deal_list_proves_nothing():
+    deals_ = [{"id": str(n), "bid_id": ""} for n in range(10)]
+    Reconciler.tick(FakeApi([], deals_))
+    Reconciler.tick(FakeApi([], deals_[1:]))
+    assert not Reconciler.deals_complete
+    assert Reconciler.deal_status("0") is None
+
+
+def test_stale_snapshot_is_not_used():
+    Reconciler.tick(FakeApi([{"id": "1", "tag": "A_1"}], []))
+    Reconciler.updated -= 2 * 60
+    assert Reconciler.order_status("1") is None
+
+
+def test_snapshot_is_kept_while_breaker_is_open():
+    Reconciler.tick(FakeApi([{"id": "1", "tag": "A_1"}], []))
+    Reconciler.tick(FakeApi(CircuitOpenError(10), []))
+    assert "1" in Reconciler.orders and Reconciler.is_fresh()
+
+
+def test_loaded_snapshot_matches_tick():
+    orders_, deals_, limit = Reconciler.fetch(FakeApi([{"id": "1", "tag": "A_1"}], []))
+    Reconciler.load(orders_, deals_, limit)
+    assert Reconciler.order_status("1")["orderStatus"] == 2
@@ -0,0 +1,69 @@
+import asyncio
+import threading
+import time
+
+from source.retry import RetryPolicy, interruptible
+
+
+def test_delays_grow_until_attempts_are_used():
+    retries = RetryPolicy(attempts=3, backoff=1, max_backoff=3, deadline=100, jitter=0).start()
+    assert [retries.next_delay() for _ in range(4)] == [1, 2, 3, None]
+
+
+def test_deadline_counts_from_call_start():
+    retries = RetryPolicy(attempts=10, backoff=4, deadline=30, jitter=0).start()
+    retries.started = time.time() - 27
+    # Delay leaves at least one second for the next attempt
+    assert 1.9 < retries.next_delay() <= 2
+    retries.started = time.time() - 29.5
+    assert retries.next_delay() is None
+
+
+def test_retry_timeout_is_capped_by_deadline():
+    retries = RetryPolicy(deadline=30).start()
+    assert retries.timeout(60) == 60
+    retries.retries = 1
+    retries.started = time.time() - 25
+    assert 4.9 < retries.timeout(60) <= 5
+    retries.started = time.time() - 40
+    assert retries.timeout(60) == 1
+
+
+def test_config_overrides_known_keys():
+    policy = RetryPolicy().with_config({"attempts": 5, "deadline": 60, "unknown": 1})
+    assert (policy.attempts, policy.deadline, policy.backoff) == (5, 60, 1)
+
+
+def test_wait_is_interrupted_by_node_event():
+    event = threading.Event()
+    event.set()
+    started = time.time()
+    with interruptible(event):
+        assert RetryPolicy.wait(5)
+        assert asyncio.run(RetryPolicy.wait_async(5))
+    assert time.time() - started < 1
+    assert not RetryPolicy.wait(0.01)
+
+
+def test_async_wait_stops_on_node_wakeup():
+    async def wait(stop):
+        loop = asyncio.get_running_loop()
+        event = threading.Event()
+        wakeup = asyncio.Event()
+
+        def wake():
+            if stop:
+                event.set()
+            loop.call_soon_threadsafe(wakeup.set)
+
+        threading.Timer(0.05, wake).start()
+        started = time.time()
+        with interruptible(event, wakeup):
+            interrupted = await RetryPolicy.wait_async(0.5)
+        return interrupted, time.time() - started
+
+    interrupted, waited = asyncio.run(wait(True))
+    assert interrupted and waited < 0.2
+    # Wakeup without stop doesn't end retry wait
+    interrupted, waited = asyncio.run(wait(False))
+    assert not interrupted and waited >= 0.5
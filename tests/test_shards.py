@@ -0,0 +1,87 @@
+import queue
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from source.config import Config
+from source.shards import Coordinator, RemoteNode, ShardLink, node_record
+from source.utils import Nodes
+from source.worknode import State, WorkNode
+
+
+@pytest.fixture
+def nodes(workdir):
+    Config.load_config()
+    for node_tag in Config.node_configs:
+        Nodes.add_node(WorkNode.create_empty(None, node_tag))
+    return Nodes.get_nodes_arr()
+
+
+def test_shard_sends_only_changed_and_removed_nodes(nodes):
+    states = queue.Queue()
+    link = ShardLink(1, states, queue.Queue(), metrics_interval=3600)
+    link.publish()
+    kind, shard, changed_, removed_ = states.get_nowait()
+    assert (kind, shard, removed_) == ("nodes", 1, [])
+    assert [record["node_tag"] for record in changed_] == ["TEST_1", "TEST_2", "TEST_3"]
+    assert states.get_nowait()[0] == "metrics"
+    Nodes.get_node("TEST_2").status = State.AWAITING_DEAL
+    Nodes.remove_node("TEST_3")
+    link.publish()
+    kind, shard, changed_, removed_ = states.get_nowait()
+    assert [(record["node_tag"], record["status"]) for record in changed_] == [("TEST_2", "AWAITING_DEAL")]
+    assert removed_ == ["TEST_3"]
+    link.publish()
+    assert states.empty()
+
+
+def test_shard_runs_coordinator_commands(nodes):
+    commands = queue.Queue()
+    link = ShardLink(0, queue.Queue(), commands)
+    drained = []
+    listener = threading.Thread(target=link.listen, args=({"drain": drained.append},))
+    listener.start()
+    commands.put(("drain", ("TEST",)))
+    commands.put(("unknown", ()))
+    link.stopped.set()
+    listener.join(5)
+    assert drained == ["TEST"]
+
+
+def test_coordinator_collects_remote_nodes(nodes):
+    records = [node_record(node) for node in nodes]
+    Nodes.clear()
+    coordinator = Coordinator(2, None)
+    coordinator.states = queue.Queue()
+    collector = threading.Thread(target=coordinator.collect)
+    collector.start()
+    coordinator.states.put(("nodes", 1, records, []))
+    coordinator.states.put(("nodes", 1, [dict(records[0], status="TASK_RUNNING", deal_id="10")], ["TEST_3"]))
+    coordinator.finished.set()
+    collector.join(5)
+    remote_ = Nodes.get_node("TEST_1")
+    assert isinstance(remote_, RemoteNode)
+    assert (remote_.shard, remote_.status, remote_.deal_id) == (1, State.TASK_RUNNING, "10")
+    assert sorted(node.node_tag for node in Nodes.get_nodes_arr()) == ["TEST_1", "TEST_2"]
+
+
+def test_crashed_shard_is_restarted_then_dropped(nodes, monkeypatch):
+    Config.base_config["shard_restarts"] = 1
+    records = [node_record(node) for node in nodes]
+    Nodes.clear()
+    for record in records:
+        Nodes.add_node(RemoteNode(1 if record["node_tag"] == "TEST_3" else 0, record))
+    coordinator = Coordinator(2, None)
+    started = []
+    monkeypatch.setattr(coordinator, "start_shard", lambda shard: started.append(shard) or crashed())
+    coordinator.processes = [crashed(), SimpleNamespace(is_alive=lambda: False, exitcode=0, name="shard-1")]
+    coordinator.check_shards()
+    assert started == [0] and coordinator.restarts == [1, 0]
+    coordinator.check_shards()
+    assert started == [0] and coordinator.processes[0] is None
+    assert [node.node_tag for node in Nodes.get_nodes_arr()] == ["TEST_3"]
+
+
+def crashed():
+    return SimpleNamespace(is_alive=lambda: False, exitcode=1, name="shard-0")
@@ -0,0 +1,77 @@
+import threading
+import time
+
+import requests
+
+from source.config import Config
+from source.init import check_balance, init_nodes_state
+from source.journal import Journal
+from source.sonmapi import SonmApi
+from source.utils import Nodes, parse_price
+from source.worknode import State, WorkNode
+
+EMPTY = {"token.balance": {}, "predictor.predict": {}, "deal.list": {"deals": []}, "order.list": {"orders": []}}
+
+
+class RestartingNode(object):
+    # Node api which refuses connections until it is up
+    def __init__(self, up_after):
+        self.eth_addr = "0x" + "0" * 40
+        self.session = requests.Session()
+        self.up_at = time.time() + up_after
+        self.calls = 0
+
+    def __getattr__(self, group):
+        return Group(self, group)
+
+
+class Group(object):
+    def __init__(self, node, group):
+        self.node = node
+        self.group = group
+
+    def __getattr__(self, method):
+        def call(*args, timeout=60):
+            self.node.calls += 1
+            if time.time() < self.node.up_at:
+                return {"status_code": 0, "error": "Connection refused"}
+            return dict(EMPTY["{}.{}".format(self.group, method)], status_code=200)
+
+        return call
+
+
+def sonm_api(node):
+    return SonmApi("", "", "", 1, node=node, retry_config={"default": {"attempts": 0}},
+                   circuit_breaker={"threshold": 2, "reset_timeout": 0.2})
+
+
+def test_recovery_waits_for_node_api(workdir):
+    Config.load_config()
+    node = RestartingNode(up_after=0.5)
+    api = sonm_api(node)
+    check_balance(api)
+    check_balance(api)
+    assert api.breaker.is_open()
+    init_nodes_state(api)
+    assert time.time() >= node.up_at
+    assert not api.breaker.is_open()
+    assert [node_.status for node_ in Nodes.get_nodes_arr()] == [State.START] * 3
+
+
+def test_journal_is_restored_while_node_api_is_down(workdir):
+    Config.load_config()
+    Journal.open("state.db")
+    WorkNode(State.TASK_RUNNING, None, "TEST_1", "6", "7", "5", parse_price("0.01USD/h"))
+    Nodes.clear()
+    node = RestartingNode(up_after=0.5)
+    api = sonm_api(node)
+    check_balance(api)
+    check_balance(api)
+    init_nodes_state(api)
+    # Nodes are restored before node api is up, verification waits for it in background
+    assert time.time() < node.up_at
+    assert Nodes.get_node("TEST_1").status == State.TASK_RUNNING
+    for thread in threading.enumerate():
+        if thread.name == "journal-verify":
+            thread.join(5)
+    assert not api.breaker.is_open()
@@ -0,0 +1,81 @@
+import threading
+from concurrent.futures import Future
+
+import pytest
+
+from source.config import Config, ConfigDiff
+from source.reconciler import Reconciler
+from source.supervisor import Supervisor
+from source.utils import Nodes
+from source.worknode import WorkNode
+
+
+class FakeEngine(object):
+    sonm_api = None
+
+    def __init__(self):
+        self.submitted = []
+
+    def submit(self, node, delay=0):
+        future = Future()
+        self.submitted.append((node.node_tag, delay, future))
+        return future
+
+
+@pytest.fixture
+def supervisor(workdir):
+    Config.load_config()
+    for node_tag in Config.node_configs:
+        Nodes.add_node(WorkNode.create_empty(None, node_tag))
+    return Supervisor(FakeEngine(), restart_delay=10)
+
+
+def test_node_is_submitted_once(supervisor):
+    supervisor.schedule_all()
+    supervisor.schedule(Nodes.get_node("TEST_1"))
+    assert [(node_tag, delay) for node_tag, delay, future in supervisor.engine.submitted] == \
+        [("TEST_1", 0), ("TEST_2", 0), ("TEST_3", 0)]
+    assert not supervisor.idle.is_set()
+
+
+def test_failed_node_is_restarted_after_delay(supervisor):
+    node = Nodes.get_node("TEST_1")
+    supervisor.schedule(node)
+    supervisor.engine.submitted[0][2].set_exception(ValueError("failed"))
+    assert [(node_tag, delay) for node_tag, delay, future in supervisor.engine.submitted] == \
+        [("TEST_1", 0), ("TEST_1", 10)]
+    assert not node.RUNNING
+    assert supervisor.scheduled["TEST_1"] is supervisor.engine.submitted[1][2]
+
+
+def test_stopped_node_is_not_restarted(supervisor):
+    node = Nodes.get_node("TEST_1")
+    supervisor.schedule(node)
+    node.stop_work()
+    supervisor.engine.submitted[0][2].set_exception(ValueError("failed"))
+    assert len(supervisor.engine.submitted) == 1
+    assert supervisor.idle.is_set()
+
+
+def test_wait_returns_when_all_nodes_are_done(supervisor):
+    supervisor.schedule_all()
+    waiter = threading.Thread(target=supervisor.wait)
+    waiter.start()
+    for node_tag, delay, future in supervisor.engine.submitted:
+        assert waiter.is_alive()
+        future.set_result(None)
+    waiter.join(5)
+    assert not waiter.is_alive()
+    assert supervisor.scheduled == {}
+
+
+def test_config_change_schedules_added_and_drains_removed_nodes(supervisor, monkeypatch):
+    monkeypatch.setattr(Reconciler, "orders_by_tag", {})
+    removed_ = Nodes.get_node("TEST_3")
+    supervisor.on_config_change(ConfigDiff(added={"TEST_2"}, removed={"TEST_3"}, changed=set(), changed_bids=set()))
+    assert [node_tag for node_tag, delay, future in supervisor.engine.submitted] == ["TEST_2"]
+    for thread in threading.enumerate():
+        if thread.name == "remove-nodes":
+            thread.join(5)
+    assert not Nodes.has_node("TEST_3")
+    assert not removed_.KEEP_WORK
@@ -0,0 +1,53 @@
+import sys
+import types
+
+import pytest
+import requests
+
+from source.transport import PooledTransport, SessionRequests
+
+
+def client_package(monkeypatch):
+    # Node api client which calls module level requests functions
+    package_ = types.ModuleType("fake_pynode")
+    main_ = types.ModuleType("fake_pynode.main")
+    main_.requests = requests
+    main_.Node = type("Node", (object,), {"__module__": "fake_pynode.main"})
+    monkeypatch.setitem(sys.modules, "fake_pynode", package_)
+    monkeypatch.setitem(sys.modules, "fake_pynode.main", main_)
+    monkeypatch.setattr(PooledTransport, "patched", {})
+    return main_
+
+
+def test_client_module_is_patched_once(monkeypatch):
+    main_ = client_package(monkeypatch)
+    first = PooledTransport()
+    first.install(main_.Node())
+    patched_ = main_.requests
+    assert isinstance(patched_, SessionRequests)
+    assert patched_.session is first.session
+    second = PooledTransport()
+    second.install(main_.Node())
+    assert main_.requests is patched_
+    assert patched_.session is second.session
+    assert patched_.exceptions is requests.exceptions
+
+
+def test_node_session_is_replaced(monkeypatch):
+    monkeypatch.setattr(PooledTransport, "patched", {})
+    node = types.SimpleNamespace(session=requests.Session())
+    transport = PooledTransport()
+    transport.install(node)
+    assert node.session is transport.session
+    assert PooledTransport.patched == {}
+
+
+def test_real_client_is_patched(monkeypatch):
+    main_ = pytest.importorskip("sonm_pynode.main")
+    if getattr(main_, "requests", None) is not requests:
+        pytest.skip("sonm_pynode doesn't call requests module")
+    monkeypatch.setattr(main_, "requests", requests)
+    monkeypatch.setattr(PooledTransport, "patched", {})
+    transport = PooledTransport()
+    transport.install(object.__new__(main_.Node))
+    assert main_.requests.session is transport.session